@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark of directory listing models.
+
+Compares peak memory and time of building and serializing the listing of
+a synthetic directory as a list of full contents model dicts, as done by
+the contents API, and as compact records serialized in streamed chunks,
+as done by the `/api/onedata/listing` endpoint.
+
+Usage:
+    python benchmarks/listing.py [--entries N] [--repeat N]
+"""
+
+import argparse
+import datetime
+import json
+import mimetypes
+import os
+import sys
+import time
+import tracemalloc
+
+from fs.info import Info
+from fs.time import epoch_to_datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from onedatafs_jupyter.listing import iter_listing_json, \
+    list_entries  # noqa: E402
+
+EXTENSIONS = ['.ipynb', '.py', '.csv', '.txt', '.png', '']
+
+
+class SyntheticFS(object):
+    """Filesystem stub returning details of a generated directory."""
+
+    def __init__(self, entries):
+        """
+        Create the stub.
+
+        :param int entries: Number of entries in the directory.
+        """
+        self.entries = entries
+
+    def scandir(self, path, namespaces=None):
+        """Generate details of the directory entries."""
+        now = time.time()
+        for i in range(self.entries):
+            is_dir = i % 10 == 0
+            yield Info({
+                'basic': {
+                    'name': 'entry-%06d%s' % (
+                        i, '' if is_dir else EXTENSIONS[i % 6]),
+                    'is_dir': is_dir,
+                },
+                'details': {
+                    'type': 1 if is_dir else 2,
+                    'size': 0 if is_dir else i * 37,
+                    'modified': now - i,
+                    'created': now - 2 * i,
+                    'accessed': now,
+                },
+            })
+
+
+def json_default(obj):
+    """Serialize dates like the Jupyter contents API does."""
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat().replace('+00:00', 'Z')
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def dict_listing(fs, path):
+    """
+    List a directory as full model dicts and serialize it at once.
+
+    :return int: Length of the serialized listing.
+    """
+    content = []
+    for info in fs.scandir(path, namespaces=['details']):
+        entry_path = '%s/%s' % (path, info.name)
+        if info.is_dir:
+            entry_type, mimetype, size = 'directory', None, None
+        elif info.name.endswith('.ipynb'):
+            entry_type, mimetype, size = 'notebook', None, info.size
+        else:
+            entry_type = 'file'
+            mimetype = mimetypes.guess_type(entry_path)[0]
+            size = info.size
+        content.append({
+            'name': info.name,
+            'path': entry_path,
+            'last_modified': epoch_to_datetime(
+                info.raw['details']['modified']),
+            'created': epoch_to_datetime(info.raw['details']['created']),
+            'content': None,
+            'format': None,
+            'mimetype': mimetype,
+            'size': size,
+            'writable': True,
+            'type': entry_type,
+        })
+    model = {'name': 'dir', 'path': path, 'type': 'directory',
+             'content': content, 'format': 'json'}
+    return len(json.dumps(model, default=json_default))
+
+
+def compact_listing(fs, path):
+    """
+    List a directory as compact records and serialize it in chunks.
+
+    :return int: Length of the serialized listing.
+    """
+    entries = list_entries(fs, path)
+    model = {'name': 'dir', 'path': path, 'type': 'directory'}
+    return sum(len(chunk) for chunk in iter_listing_json(
+        model, entries, default=json_default))
+
+
+def measure(listing, fs, repeat):
+    """
+    Measure the best time and the peak memory of a listing.
+
+    :return tuple: Seconds, peak bytes and the serialized length.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        length = listing(fs, 'dir')
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    listing(fs, 'dir')
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, length
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--entries', type=int, default=100000,
+                        help='number of directory entries')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of timed runs of each listing')
+    args = parser.parse_args()
+
+    fs = SyntheticFS(args.entries)
+    print("%-8s %10s %12s %12s" % ('listing', 'time [s]', 'peak [MB]',
+                                   'us/entry'))
+    for name, listing in [('dict', dict_listing),
+                          ('compact', compact_listing)]:
+        elapsed, peak, _ = measure(listing, fs, args.repeat)
+        print("%-8s %10.3f %12.1f %12.2f" % (
+            name, elapsed, peak / 1024.0 / 1024.0,
+            elapsed * 1e6 / args.entries))
+
+
+if __name__ == '__main__':
+    main()
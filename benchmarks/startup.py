@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""
+Benchmark of the OnedataFS Jupyter contents manager startup.
+
+Measures in fresh interpreters the time to import the package, to resolve
+the contents manager class (as Jupyter does when loading the
+configuration) and, if a Oneprovider is configured using
+`ONEPROVIDER_HOST`, `ONEDATA_TOKEN` and `ONEDATA_SPACE` environment
+variables, the time until the first directory listing is returned.
+
+Usage:
+    python benchmarks/startup.py [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PACKAGE = """
+import time
+start = time.time()
+import onedatafs_jupyter  # noqa
+print(json.dumps({'import_package': time.time() - start}))
+"""
+
+IMPORT_MANAGER = """
+import time
+start = time.time()
+import onedatafs_jupyter
+onedatafs_jupyter.OnedataFSContentsManager
+print(json.dumps({'import_manager': time.time() - start}))
+"""
+
+FIRST_LISTING = """
+import os
+import time
+start = time.time()
+from onedatafs_jupyter import OnedataFSContentsManager
+imported = time.time()
+cm = OnedataFSContentsManager(
+    oneprovider_host=os.environ['ONEPROVIDER_HOST'],
+    access_token=os.environ['ONEDATA_TOKEN'],
+    space=os.environ['ONEDATA_SPACE'],
+    insecure=True)
+created = time.time()
+cm.get('', content=True)
+listed = time.time()
+print(json.dumps({
+    'import_manager': imported - start,
+    'create_manager': created - imported,
+    'first_listing': listed - created,
+    'time_to_first_listing': listed - start,
+    'connect': cm.readiness()['connect_time'],
+}))
+"""
+
+
+def run(code):
+    """
+    Run a benchmark snippet in a fresh interpreter.
+
+    :param str code: The snippet printing a JSON dict of timings.
+    :return dict: The timings.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    output = subprocess.check_output(
+        [sys.executable, '-c', 'import json\n' + code], env=env)
+    return json.loads(output.decode('utf8').strip().splitlines()[-1])
+
+
+def median(values):
+    """Return the median of a non-empty list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    """Run the benchmarks and print median timings."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs of each benchmark')
+    args = parser.parse_args()
+
+    snippets = [IMPORT_PACKAGE, IMPORT_MANAGER]
+    if all(os.environ.get(v) for v in ('ONEPROVIDER_HOST', 'ONEDATA_TOKEN',
+                                       'ONEDATA_SPACE')):
+        snippets.append(FIRST_LISTING)
+    else:
+        print("Oneprovider not configured, skipping time to first listing")
+
+    results = {}
+    for snippet in snippets:
+        for _ in range(args.repeat):
+            for name, value in run(snippet).items():
+                if value is not None:
+                    results.setdefault(name, []).append(value)
+
+    for name, values in sorted(results.items()):
+        print("%-24s %8.1f ms (median of %d)" % (
+            name, median(values) * 1000, len(values)))
+
+
+if __name__ == '__main__':
+    main()
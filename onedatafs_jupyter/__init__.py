@@ -6,7 +6,53 @@ __copyright__ = "Copyright (C) 2019 ACK CYFRONET AGH"
 __license__ = "This software is released under the MIT license cited in " \
               "LICENSE.txt"
 
+import importlib
 import sys
+import types
 
-if "pytest" not in sys.modules:
-    from .onedata_contents_manager import OnedataFSContentsManager, OnedataSubFS # noqa
+# Public names are imported on first access, so that importing the package
+# does not load notebook, nbformat or the native oneclient bindings
+_LAZY_ATTRIBUTES = {
+    'OnedataFSContentsManager': '.onedata_contents_manager',
+    'OnedataSubFS': 'fs.onedatafs',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+class _LazyModule(types.ModuleType):
+    """
+    Package module importing its public names on first access.
+
+    Module level `__getattr__` is supported only since Python 3.7, so the
+    class of the package module is replaced instead.
+    """
+
+    def __getattr__(self, name):
+        """Import a lazily loaded attribute and keep it in the module."""
+        if name not in _LAZY_ATTRIBUTES:
+            raise AttributeError(
+                "module %r has no attribute %r" % (self.__name__, name))
+        module = importlib.import_module(_LAZY_ATTRIBUTES[name],
+                                         self.__name__)
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        """List module attributes including the lazily loaded ones."""
+        return sorted(set(super(_LazyModule, self).__dir__()) |
+                      set(_LAZY_ATTRIBUTES))
+
+
+sys.modules[__name__].__class__ = _LazyModule
+
+
+def _jupyter_server_extension_paths():
+    return [{'module': 'onedatafs_jupyter'}]
+
+
+def load_jupyter_server_extension(nb_server_app):
+    """Register the OnedataFS contents manager API handlers."""
+    from .handlers import load_handlers
+    load_handlers(nb_server_app)
@@ -0,0 +1,358 @@
+# coding: utf-8
+"""Streaming export and import of OnedataFS directories as archives."""
+
+import gzip
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent import futures
+
+from fs import errors as fs_errors
+from fs.path import abspath, dirname, join, normpath, relpath
+
+#: Supported archive formats and their MIME types
+ARCHIVE_FORMATS = {
+    'zip': 'application/zip',
+    'tar.gz': 'application/gzip',
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """The archive is invalid or contains unsupported entries."""
+
+
+def detect_format(fileobj):
+    """
+    Detect the archive format from its leading bytes.
+
+    :param fileobj: Seekable file object positioned at the archive start.
+    :return str: The archive format or `None` if unknown.
+    """
+    magic = fileobj.read(4)
+    fileobj.seek(0)
+    if magic.startswith(b'PK\x03\x04') or magic.startswith(b'PK\x05\x06'):
+        return 'zip'
+    if magic.startswith(b'\x1f\x8b'):
+        return 'tar.gz'
+    return None
+
+
+class ChunkWriter(object):
+    """
+    Non-seekable file object passing written data to a consumer in chunks.
+
+    Data is collected into chunks of `chunk_size` bytes, which are passed
+    to the `consume` callable. Writing blocks while `max_chunks` chunks
+    have not been acknowledged by `consumed`, which bounds the memory used
+    when the consumer is slower than the archive producer. The end of data
+    is passed as `None`, also when the stream was cancelled.
+    """
+
+    def __init__(self, consume, chunk_size=CHUNK_SIZE, max_chunks=8):
+        """
+        Create the writer.
+
+        :param consume: Callable receiving the chunks, it must not block.
+        :param int chunk_size: Size of chunks passed to the consumer.
+        :param int max_chunks: Maximum number of unacknowledged chunks.
+        """
+        self.consume = consume
+        self.chunk_size = chunk_size
+        self.cancelled = threading.Event()
+        self._slots = threading.Semaphore(max_chunks)
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        """
+        Append data, blocking while too many chunks are not consumed.
+
+        :param bytes data: The data to write.
+        :return int: Number of written bytes.
+        """
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer))
+            del self._buffer[:]
+        return len(data)
+
+    def tell(self):
+        """Return the number of bytes written so far."""
+        return self._position
+
+    def seekable(self):
+        """Return False, the writer only supports sequential writes."""
+        return False
+
+    def flush(self):
+        """Do nothing, data is passed on in whole chunks."""
+
+    def consumed(self):
+        """Acknowledge that a chunk has been consumed."""
+        self._slots.release()
+
+    def close(self):
+        """Pass on buffered data and mark the end of the stream."""
+        try:
+            if self._buffer:
+                self._put(bytes(self._buffer))
+                del self._buffer[:]
+        finally:
+            self.consume(None)
+
+    def _put(self, chunk):
+        """
+        Pass a chunk to the consumer unless it went away.
+
+        :param bytes chunk: The chunk of data.
+        """
+        while not self.cancelled.is_set():
+            if self._slots.acquire(timeout=1.0):
+                if self.cancelled.is_set():
+                    break
+                self.consume(chunk)
+                return
+        raise IOError('Archive stream was cancelled')
+
+
+def _mtime(info):
+    """
+    Get the modification time of a resource.
+
+    :param Info info: Resource details with the `details` namespace.
+    :return float: The modification timestamp.
+    """
+    return info.raw.get('details', {}).get('modified') or time.time()
+
+
+def _walk_files(fs, path):
+    """
+    Walk a directory tree, skipping hidden files and directories.
+
+    :param fs: The filesystem to walk.
+    :param str path: The root directory.
+    :return: Generator of tuples with the directory path relative to
+             `path`, the absolute directory path, its modification time,
+             list of file details and whether the directory is empty.
+    """
+    root = path.rstrip('/')
+    mtimes = {}
+    for dir_path, dirs, files in fs.walk(path, namespaces=['details'],
+                                         exclude_dirs=['.*']):
+        # Directories are walked after their parent, which lists them
+        for info in dirs:
+            mtimes[join(dir_path, info.name)] = _mtime(info)
+        files = [info for info in files if not info.name.startswith('.')]
+        prefix = relpath(dir_path[len(root):])
+        yield (prefix, dir_path, mtimes.pop(dir_path, None) or time.time(),
+               files, not dirs and not files)
+
+
+def _write_zip_entry(archive, zinfo, src, mtime, chunk_size=CHUNK_SIZE):
+    """
+    Compress a file into a zip archive in chunks.
+
+    :param ZipFile archive: The archive open for writing.
+    :param ZipInfo zinfo: Details of the archive entry.
+    :param src: File object with the entry data.
+    :param float mtime: Modification time of the file.
+    :param int chunk_size: Size of chunks read from `src`.
+    """
+    if sys.version_info >= (3, 6):
+        with archive.open(zinfo, 'w', force_zip64=True) as dst:
+            shutil.copyfileobj(src, dst, chunk_size)
+        return
+
+    # Entries can be written from file objects since Python 3.6, older
+    # versions compress them from a local file
+    with tempfile.NamedTemporaryFile() as spool:
+        shutil.copyfileobj(src, spool, chunk_size)
+        spool.flush()
+        os.chmod(spool.name, 0o644)
+        os.utime(spool.name, (mtime, mtime))
+        archive.write(spool.name, zinfo.filename, zinfo.compress_type)
+
+
+def write_archive(fs, path, fileobj, fmt, compresslevel=1,
+                  chunk_size=CHUNK_SIZE):
+    """
+    Write a directory tree to a file object as an archive.
+
+    Files are read and compressed sequentially in chunks, so memory usage
+    does not depend on file sizes and `fileobj` does not need to be
+    seekable. Hidden files and directories are skipped.
+
+    :param fs: The filesystem to read from.
+    :param str path: The directory to archive.
+    :param fileobj: Writable file object receiving the archive.
+    :param str fmt: `zip` or `tar.gz`.
+    :param int compresslevel: Compression level from 0 to 9.
+    :param int chunk_size: Size of chunks read from files.
+    """
+    if fmt not in ARCHIVE_FORMATS:
+        raise ArchiveError('Unsupported archive format: %s' % fmt)
+
+    path = abspath(normpath(path))
+    if fmt == 'zip':
+        compression = zipfile.ZIP_DEFLATED if compresslevel else \
+            zipfile.ZIP_STORED
+        options = {}
+        if sys.version_info >= (3, 7):
+            # Older versions always use the default compression level
+            options['compresslevel'] = compresslevel or None
+        with zipfile.ZipFile(fileobj, 'w', compression, allowZip64=True,
+                             **options) as archive:
+            for prefix, dir_path, mtime, files, empty in \
+                    _walk_files(fs, path):
+                if prefix and empty:
+                    zinfo = zipfile.ZipInfo(prefix + '/',
+                                            time.gmtime(mtime)[:6])
+                    zinfo.external_attr = (0o40755 << 16) | 0x10
+                    archive.writestr(zinfo, b'')
+                for info in files:
+                    zinfo = zipfile.ZipInfo(join(prefix, info.name),
+                                            time.gmtime(_mtime(info))[:6])
+                    zinfo.compress_type = compression
+                    zinfo.external_attr = 0o644 << 16
+                    with fs.openbin(join(dir_path, info.name), 'r') as src:
+                        _write_zip_entry(archive, zinfo, src, _mtime(info),
+                                         chunk_size)
+        return
+
+    gz = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=compresslevel)
+    with gz, tarfile.open(fileobj=gz, mode='w|',
+                          format=tarfile.PAX_FORMAT) as archive:
+        for prefix, dir_path, mtime, files, _ in _walk_files(fs, path):
+            if prefix:
+                tarinfo = tarfile.TarInfo(prefix)
+                tarinfo.type = tarfile.DIRTYPE
+                tarinfo.mode = 0o755
+                tarinfo.mtime = mtime
+                archive.addfile(tarinfo)
+            for info in files:
+                tarinfo = tarfile.TarInfo(join(prefix, info.name))
+                tarinfo.size = info.size
+                tarinfo.mode = 0o644
+                tarinfo.mtime = _mtime(info)
+                with fs.openbin(join(dir_path, info.name), 'r') as src:
+                    archive.addfile(tarinfo, src)
+
+
+def _members(fileobj, fmt):
+    """
+    Iterate over entries of an archive.
+
+    :param fileobj: Seekable file object with the archive.
+    :param str fmt: `zip` or `tar.gz`.
+    :return: Generator of tuples with the entry name, whether it is
+             a directory and a callable opening the entry data.
+    """
+    if fmt == 'zip':
+        with zipfile.ZipFile(fileobj, 'r') as archive:
+            for zinfo in archive.infolist():
+                yield (zinfo.filename, zinfo.filename.endswith('/'),
+                       lambda zinfo=zinfo: archive.open(zinfo, 'r'))
+        return
+
+    with tarfile.open(fileobj=fileobj, mode='r|gz') as archive:
+        for tarinfo in archive:
+            if not tarinfo.isfile() and not tarinfo.isdir():
+                continue
+            yield (tarinfo.name, tarinfo.isdir(),
+                   lambda tarinfo=tarinfo: archive.extractfile(tarinfo))
+
+
+def _target_path(path, name):
+    """
+    Compute the path to which an archive entry is extracted.
+
+    :param str path: The directory into which the archive is extracted.
+    :param str name: The archive entry name.
+    :return str: Path of the extracted entry.
+    """
+    try:
+        name = relpath(normpath(name.replace('\\', '/')))
+    except fs_errors.IllegalBackReference:
+        raise ArchiveError('Invalid archive entry name: %s' % name)
+    if not name or name.startswith('../'):
+        raise ArchiveError('Invalid archive entry name: %s' % name)
+    return join(path, name)
+
+
+def extract_archive(fs, path, fileobj, fmt, workers=4,
+                    spool_size=CHUNK_SIZE * 16):
+    """
+    Extract an archive into a directory, writing files in parallel.
+
+    Entries are read from the archive sequentially and spooled into
+    temporary files (kept in memory up to `spool_size` bytes), which are
+    then uploaded by `workers` threads. At most twice as many entries as
+    workers are spooled at once, which bounds the memory usage.
+
+    :param fs: The filesystem to write to.
+    :param str path: The target directory.
+    :param fileobj: Seekable file object with the archive.
+    :param str fmt: `zip` or `tar.gz`.
+    :param int workers: Number of parallel uploads.
+    :param int spool_size: Size of entries kept in memory.
+    :return list: Paths of extracted files.
+    """
+    if fmt not in ARCHIVE_FORMATS:
+        raise ArchiveError('Unsupported archive format: %s' % fmt)
+
+    path = abspath(normpath(path))
+    slots = threading.BoundedSemaphore(workers * 2)
+    created = set()
+    extracted = []
+
+    def makedirs(dir_path):
+        if dir_path not in created:
+            fs.makedirs(dir_path, recreate=True)
+            created.add(dir_path)
+
+    def upload(target, spool):
+        try:
+            with spool:
+                spool.seek(0)
+                fs.upload(target, spool, chunk_size=CHUNK_SIZE)
+        finally:
+            slots.release()
+
+    fs.makedirs(path, recreate=True)
+    pending = []
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for name, is_dir, open_entry in _members(fileobj, fmt):
+                target = _target_path(path, name)
+                if is_dir:
+                    makedirs(target)
+                    continue
+
+                makedirs(dirname(target))
+                spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+                with open_entry() as src:
+                    shutil.copyfileobj(src, spool, CHUNK_SIZE)
+
+                slots.acquire()
+                pending.append(executor.submit(upload, target, spool))
+                extracted.append(target)
+
+                # Fail early if any upload has failed already
+                for future in [f for f in pending if f.done()]:
+                    pending.remove(future)
+                    future.result()
+        except (zipfile.BadZipfile, tarfile.TarError, EOFError) as e:
+            raise ArchiveError('Invalid %s archive: %s' % (fmt, e))
+        finally:
+            for future in pending:
+                future.result()
+
+    return extracted
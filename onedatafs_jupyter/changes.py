@@ -0,0 +1,378 @@
+# coding: utf-8
+"""Metadata cache and change notifications for OnedataFS resources."""
+
+import errno
+import threading
+import time
+from collections import OrderedDict
+
+from fs import errors as fs_errors
+from fs.path import abspath, dirname, join, normpath, relpath
+from fs.time import epoch_to_datetime
+
+
+def _normalize(path):
+    """
+    Normalize a contents path to an absolute storage path.
+
+    :param str path: The contents path.
+    :return str: The absolute normalized path.
+    """
+    return abspath(normpath(path or '/'))
+
+
+def _isoformat(timestamp):
+    """
+    Format a POSIX timestamp like the Jupyter contents API does.
+
+    :param float timestamp: The timestamp or `None`.
+    :return str: ISO 8601 UTC date or `None`.
+    """
+    if timestamp is None:
+        return None
+    return epoch_to_datetime(timestamp).isoformat().replace('+00:00', 'Z')
+
+
+def is_not_found(error):
+    """
+    Check whether a storage error means that a resource does not exist.
+
+    :param Exception error: The error raised by a storage operation.
+    :return bool: Whether the resource does not exist.
+    """
+    if isinstance(error, fs_errors.ResourceNotFound):
+        return True
+    return isinstance(error, EnvironmentError) and \
+        getattr(error, 'errno', None) == errno.ENOENT
+
+
+class MetadataCache(object):
+    """
+    Bounded cache of resource details with time based expiry.
+
+    Missing resources are cached as `None`, so that repeated existence
+    checks of the same path do not reach the storage either.
+    """
+
+    def __init__(self, ttl=0.0, max_entries=10000):
+        """
+        Create an empty cache.
+
+        :param float ttl: Seconds for which an entry is valid, 0 disables
+                          caching.
+        :param int max_entries: Maximum number of cached entries.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, path):
+        """
+        Look up details of a resource.
+
+        :param str path: The resource path.
+        :return tuple: Whether the entry was found and the cached `Info`,
+                       which is `None` for a missing resource.
+        """
+        if not self.ttl:
+            return False, None
+
+        path = _normalize(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return False, None
+            expires, info = entry
+            if expires < time.time():
+                del self._entries[path]
+                return False, None
+            return True, info
+
+    def put(self, path, info):
+        """
+        Store details of a resource.
+
+        :param str path: The resource path.
+        :param Info info: The resource details or `None` if it is missing.
+        """
+        if not self.ttl:
+            return
+
+        path = _normalize(path)
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries[path] = (time.time() + self.ttl, info)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path, recursive=False):
+        """
+        Remove a resource and its parent directory from the cache.
+
+        :param str path: The resource path.
+        :param bool recursive: Whether to remove also all cached entries
+                               below the path.
+        """
+        path = _normalize(path)
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            self._entries.pop(path, None)
+            self._entries.pop(dirname(path), None)
+            if recursive:
+                for cached in [p for p in self._entries
+                               if p.startswith(prefix)]:
+                    del self._entries[cached]
+
+
+class _Watch(object):
+    """State of a single watched path."""
+
+    __slots__ = ('callbacks', 'lease_until', 'snapshot')
+
+    def __init__(self):
+        self.callbacks = set()
+        self.lease_until = 0.0
+        self.snapshot = None
+
+
+class ChangeFeed(object):
+    """
+    Shared poller detecting changes of watched files and directories.
+
+    OnedataFS does not expose change events, so a single background thread
+    polls modification times of all watched paths. Each path is polled at
+    most once per `interval` regardless of the number of its watchers, and
+    the polled details refresh the metadata cache, so that clients polling
+    the contents API are served from the cache. Paths are watched either
+    by explicit subscribers, or for `lease` seconds after being accessed.
+    Only the details of paths watched by a lease are polled, entries of
+    directories are listed only for their subscribers.
+    """
+
+    def __init__(self, contents_manager, cache, interval=5.0, lease=60.0,
+                 max_polls_per_second=20.0):
+        """
+        Create the feed.
+
+        :param contents_manager: The `OnedataFSContentsManager` whose
+                                 storage should be polled.
+        :param MetadataCache cache: Cache refreshed by the poller.
+        :param float interval: Seconds between polls of the same path.
+        :param float lease: Seconds for which an accessed path is watched.
+        :param float max_polls_per_second: Limit of upstream polls.
+        """
+        self.parent = contents_manager
+        self.log = contents_manager.log
+        self.cache = cache
+        self.interval = interval
+        self.lease = lease
+        self.max_polls_per_second = max_polls_per_second
+        self._lock = threading.Lock()
+        self._watches = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background polling thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='onedatafs-change-feed')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background polling thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def touch(self, path):
+        """
+        Watch a path for `lease` seconds after it has been accessed.
+
+        :param str path: The accessed path.
+        """
+        path = _normalize(path)
+        with self._lock:
+            watch = self._watches.get(path)
+            if watch is None:
+                watch = self._watches[path] = _Watch()
+            watch.lease_until = time.time() + self.lease
+
+    def subscribe(self, path, callback):
+        """
+        Watch a path until unsubscribed.
+
+        :param str path: The file or directory path.
+        :param callback: Callable invoked from the poller thread with
+                         a change event dict.
+        """
+        path = _normalize(path)
+        with self._lock:
+            watch = self._watches.get(path)
+            if watch is None:
+                watch = self._watches[path] = _Watch()
+            watch.callbacks.add(callback)
+
+    def unsubscribe(self, path, callback):
+        """
+        Stop notifying a subscriber about changes of a path.
+
+        :param str path: The file or directory path.
+        :param callback: The callback passed to `subscribe`.
+        """
+        path = _normalize(path)
+        with self._lock:
+            watch = self._watches.get(path)
+            if watch is not None:
+                watch.callbacks.discard(callback)
+
+    def watched(self):
+        """
+        List currently watched paths.
+
+        :return list: The watched paths.
+        """
+        with self._lock:
+            return sorted(self._watches)
+
+    def poll(self):
+        """Poll all watched paths once and notify about their changes."""
+        now = time.time()
+        with self._lock:
+            for path in [p for p, w in self._watches.items()
+                         if not w.callbacks and w.lease_until < now]:
+                del self._watches[path]
+            watches = list(self._watches.items())
+
+        for path, watch in watches:
+            if self._stop.is_set():
+                return
+            with self._lock:
+                list_entries = bool(watch.callbacks)
+            try:
+                snapshot = self._snapshot(path, list_entries,
+                                          watch.snapshot)
+            except Exception as e:
+                self.log.warning("Cannot poll %s for changes: %s", path, e)
+                continue
+
+            previous, watch.snapshot = watch.snapshot, snapshot
+            if previous is not None and self._changed(previous, snapshot):
+                self._notify(path, watch, self._event(path, previous,
+                                                      snapshot))
+
+            if self.max_polls_per_second:
+                self._stop.wait(1.0 / self.max_polls_per_second)
+
+    def _snapshot(self, path, list_entries=False, previous=None):
+        """
+        Fetch modification times of a path and refresh the cache.
+
+        :param str path: The watched path.
+        :param bool list_entries: Whether to list entries of a directory.
+        :param tuple previous: The previous snapshot of the path, if any.
+        :return tuple: Modification time of the path and, for listed
+                       directories, a dict of modification times of its
+                       entries.
+        """
+        storage = self.parent.storage
+        try:
+            info = storage.getinfo(path, namespaces=['details'])
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            self.cache.invalidate(path, recursive=True)
+            self.cache.put(path, None)
+            return (None, None)
+
+        modified = info.raw['details'].get('modified')
+        if previous is not None and previous[0] != modified:
+            # Cached entries of a modified directory may be stale
+            self.cache.invalidate(path, recursive=True)
+        self.cache.put(path, info)
+        if not info.is_dir or not list_entries:
+            return (modified, None)
+
+        entries = {}
+        for entry in storage.scandir(path, namespaces=['details']):
+            self.cache.put(join(path, entry.name), entry)
+            entries[entry.name] = entry.raw['details'].get('modified')
+        return (modified, entries)
+
+    def _changed(self, previous, snapshot):
+        """
+        Compare two snapshots of a path.
+
+        Entries are compared only if both snapshots include them, so that
+        a path does not appear changed when its first subscriber arrives.
+
+        :param tuple previous: The previous snapshot.
+        :param tuple snapshot: The current snapshot.
+        :return bool: Whether the path has changed.
+        """
+        if previous[0] != snapshot[0]:
+            return True
+        return previous[1] is not None and snapshot[1] is not None and \
+            previous[1] != snapshot[1]
+
+    def _event(self, path, previous, snapshot):
+        """
+        Describe the difference between two snapshots of a path.
+
+        :param str path: The watched path.
+        :param tuple previous: The previous snapshot.
+        :param tuple snapshot: The current snapshot.
+        :return dict: The change event.
+        """
+        modified, entries = snapshot
+        event = {
+            'path': relpath(path),
+            'type': 'deleted' if modified is None else 'modified',
+            'last_modified': _isoformat(modified),
+        }
+        if entries is not None and previous[1] is not None:
+            old_entries = previous[1]
+            event['changes'] = sorted(
+                [{'name': n, 'type': 'created'}
+                 for n in entries if n not in old_entries] +
+                [{'name': n, 'type': 'deleted'}
+                 for n in old_entries if n not in entries] +
+                [{'name': n, 'type': 'modified'}
+                 for n in entries
+                 if n in old_entries and entries[n] != old_entries[n]],
+                key=lambda change: change['name'])
+        return event
+
+    def _notify(self, path, watch, event):
+        """
+        Invoke subscriber callbacks with a change event.
+
+        :param str path: The watched path.
+        :param _Watch watch: The watch state.
+        :param dict event: The change event.
+        """
+        self.log.debug("Detected change of %s: %s", path, event)
+        with self._lock:
+            callbacks = list(watch.callbacks)
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                self.log.error("Change notification of %s failed: %s",
+                               path, e, exc_info=True)
+
+    def _run(self):
+        """Poll watched paths every `interval` until stopped."""
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                self.poll()
+            except Exception as e:
+                self.log.error("Change feed poll failed: %s", e,
+                               exc_info=True)
+            self._stop.wait(max(0.0, self.interval - (time.time() - start)))
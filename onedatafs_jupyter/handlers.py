@@ -0,0 +1,309 @@
+# coding: utf-8
+"""Tornado handlers of the OnedataFS Jupyter server extension."""
+
+import datetime
+import json
+import tempfile
+from concurrent import futures
+
+from fs.path import basename
+
+from notebook.base.handlers import APIHandler, path_regex
+from notebook.utils import url_path_join
+
+from tornado import gen, web
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.queues import Queue, QueueEmpty, QueueFull
+
+from .archive import ARCHIVE_FORMATS, CHUNK_SIZE, ChunkWriter
+from .listing import iter_listing_json
+
+try:
+    from jupyter_client.jsonutil import json_default
+except ImportError:
+    from jupyter_client.jsonutil import date_default as json_default
+
+
+class OnedataAPIHandler(APIHandler):
+    """Base handler for endpoints of the OnedataFS contents manager."""
+
+    def onedata_service(self, name):
+        """
+        Get a service of the contents manager or fail with 404.
+
+        :param str name: Attribute name of the service.
+        :return: The service instance.
+        """
+        service = getattr(self.contents_manager, name, None)
+        if service is None:
+            raise web.HTTPError(
+                404, u'OnedataFS %s are not enabled' % name)
+        return service
+
+
+class ReadinessHandler(OnedataAPIHandler):
+    """Report whether the contents manager is connected to Oneprovider."""
+
+    @web.authenticated
+    def get(self):
+        """Respond with 200 when connected and with 503 otherwise."""
+        readiness = getattr(self.contents_manager, 'readiness', None)
+        if readiness is None:
+            raise web.HTTPError(404, u'Not a OnedataFS contents manager')
+
+        status = readiness()
+        self.set_status(200 if status['ready'] else 503)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(status))
+
+
+class ChangesHandler(OnedataAPIHandler):
+    """
+    Stream change events of a file or directory as Server-Sent Events.
+
+    Events are produced by the shared change feed of the contents manager,
+    so any number of clients watching the same path share a single poll.
+    """
+
+    #: Number of events buffered for a slow client before it is told to
+    #: reload the watched path instead
+    max_pending_events = 100
+
+    #: Seconds between keepalive comments on an idle stream
+    keepalive_interval = 15.0
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path=''):
+        """
+        Stream change events of the path until the client disconnects.
+
+        :param str path: The watched file or directory path.
+        """
+        feed = self.onedata_service('changes')
+        path = path.strip('/')
+
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+
+        loop = IOLoop.current()
+        events = Queue(maxsize=self.max_pending_events)
+        overflow = [False]
+
+        def enqueue(event):
+            try:
+                events.put_nowait(event)
+            except QueueFull:
+                overflow[0] = True
+
+        def callback(event):
+            loop.add_callback(enqueue, event)
+
+        feed.subscribe(path, callback)
+        try:
+            while True:
+                try:
+                    event = yield events.get(
+                        timeout=datetime.timedelta(
+                            seconds=self.keepalive_interval))
+                except gen.TimeoutError:
+                    self.write(': keepalive\n\n')
+                else:
+                    if overflow[0]:
+                        # Events were dropped, the client has to reload
+                        # the watched path to get into a consistent state
+                        overflow[0] = False
+                        event = {'path': path, 'type': 'overflow'}
+                        try:
+                            while True:
+                                events.get_nowait()
+                        except QueueEmpty:
+                            pass
+                    self.write('data: %s\n\n' % json.dumps(event))
+                yield self.flush()
+        except StreamClosedError:
+            pass
+        finally:
+            feed.unsubscribe(path, callback)
+
+
+class ListingHandler(OnedataAPIHandler):
+    """
+    Stream the model of a directory with its listing in JSON chunks.
+
+    The response is the same as of the contents API, but entries are kept
+    as compact records and serialized a chunk at a time, which bounds the
+    memory used by listings of very large directories.
+    """
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path=''):
+        """
+        Stream the directory model including its entries.
+
+        :param str path: The directory path.
+        """
+        cm = self.contents_manager
+        list_directory = getattr(cm, 'list_directory', None)
+        if list_directory is None:
+            raise web.HTTPError(404, u'Not a OnedataFS contents manager')
+
+        loop = IOLoop.current()
+        model, entries = yield loop.run_in_executor(
+            None, list_directory, path or '')
+
+        self.set_header('Content-Type', 'application/json')
+        chunks = iter_listing_json(model, entries, default=json_default)
+        try:
+            while True:
+                chunk = yield loop.run_in_executor(None, next, chunks, None)
+                if chunk is None:
+                    break
+                self.write(chunk)
+                yield self.flush()
+        except StreamClosedError:
+            self.log.warning("Listing of %s was interrupted", path)
+
+
+@web.stream_request_body
+class ArchiveHandler(OnedataAPIHandler):
+    """
+    Download a directory as an archive or extract an uploaded archive.
+
+    Archives are streamed in chunks in both directions, an uploaded
+    archive is spooled to a temporary file before being extracted.
+    Archives are produced in a dedicated pool of threads and their chunks
+    are passed to the IOLoop, so that slow downloads cannot exhaust the
+    default executor used by other handlers.
+    """
+
+    #: Threads producing downloaded archives, further downloads wait for
+    #: a free producer
+    producers = futures.ThreadPoolExecutor(max_workers=4)
+
+    _upload = None
+
+    def prepare(self):
+        """Set up spooling of uploaded archives."""
+        result = super(ArchiveHandler, self).prepare()
+        if self.request.method == 'PUT':
+            if self.current_user is None:
+                raise web.HTTPError(403)
+            self.request.connection.set_max_body_size(
+                self.contents_manager.archive_max_upload_size)
+            self._upload = tempfile.SpooledTemporaryFile(
+                max_size=CHUNK_SIZE * 16)
+        return result
+
+    def data_received(self, chunk):
+        """
+        Spool a chunk of an uploaded archive.
+
+        :param bytes chunk: The received data.
+        """
+        if self._upload is not None:
+            self._upload.write(chunk)
+
+    def on_finish(self):
+        """Remove the spooled upload."""
+        if self._upload is not None:
+            self._upload.close()
+            self._upload = None
+
+    @web.authenticated
+    @gen.coroutine
+    def get(self, path=''):
+        """
+        Stream a directory as an archive in `format` query argument format.
+
+        :param str path: The directory to export.
+        """
+        fmt = self.get_query_argument('format', 'zip')
+        if fmt not in ARCHIVE_FORMATS:
+            raise web.HTTPError(400, u'Unsupported archive format: %s' % fmt)
+
+        cm = self.contents_manager
+        path = path.strip('/')
+        if not cm.dir_exists(path):
+            raise web.HTTPError(404, u'No such directory: %s' % path)
+
+        self.set_header('Content-Type', ARCHIVE_FORMATS[fmt])
+        self.set_header('Content-Disposition',
+                        'attachment; filename="%s.%s"' % (
+                            basename(path) or 'onedata', fmt))
+
+        loop = IOLoop.current()
+        chunks = Queue()
+        writer = ChunkWriter(
+            lambda chunk: loop.add_callback(chunks.put_nowait, chunk))
+
+        def produce():
+            try:
+                cm.export_archive(path, writer, fmt)
+            finally:
+                try:
+                    writer.close()
+                except IOError:
+                    pass
+
+        producer = loop.run_in_executor(self.producers, produce)
+        try:
+            while True:
+                chunk = yield chunks.get()
+                if chunk is None:
+                    break
+                self.write(chunk)
+                yield self.flush()
+                writer.consumed()
+        except StreamClosedError:
+            self.log.warning("Archive download of %s was interrupted", path)
+            writer.cancelled.set()
+            try:
+                yield producer
+            except IOError:
+                pass
+            return
+        yield producer
+
+    @web.authenticated
+    @gen.coroutine
+    def put(self, path=''):
+        """
+        Extract the uploaded archive into a directory.
+
+        :param str path: The target directory.
+        """
+        fmt = self.get_query_argument('format', None)
+        if fmt is not None and fmt not in ARCHIVE_FORMATS:
+            raise web.HTTPError(400, u'Unsupported archive format: %s' % fmt)
+
+        self._upload.seek(0)
+        model = yield IOLoop.current().run_in_executor(
+            None, self.contents_manager.import_archive, path.strip('/'),
+            self._upload, fmt)
+        self.set_status(201)
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(model, default=json_default))
+
+
+default_handlers = [
+    (r'/api/onedata/ready', ReadinessHandler),
+    (r'/api/onedata/changes%s' % path_regex, ChangesHandler),
+    (r'/api/onedata/listing%s' % path_regex, ListingHandler),
+    (r'/api/onedata/archive%s' % path_regex, ArchiveHandler),
+]
+
+
+def load_handlers(nb_server_app):
+    """
+    Register the extension handlers in the Jupyter web application.
+
+    :param nb_server_app: The Jupyter notebook server application.
+    """
+    web_app = nb_server_app.web_app
+    base_url = web_app.settings['base_url']
+    web_app.add_handlers('.*$', [
+        (url_path_join(base_url, pattern), handler)
+        for pattern, handler in default_handlers])
@@ -0,0 +1,199 @@
+# coding: utf-8
+"""Compact directory listings and their streamed JSON serialization."""
+
+import functools
+import json
+import mimetypes
+
+from fs.time import epoch_to_datetime
+
+from .changes import _isoformat
+
+#: Number of entries serialized into a single chunk of a streamed listing
+ENTRIES_PER_CHUNK = 1000
+
+_DIRECTORY = 'directory'
+_NOTEBOOK = 'notebook'
+_FILE = 'file'
+
+
+class DirectoryEntry(object):
+    """
+    Compact record of a single directory entry.
+
+    Only the values which differ between entries are kept, the full
+    contents model dict is built on demand by `entry_model` or serialized
+    directly by `iter_listing_json`.
+    """
+
+    __slots__ = ('name', 'type', 'size', 'modified', 'created')
+
+    def __init__(self, name, type, size, modified, created):
+        """
+        Create the record.
+
+        :param str name: The entry name.
+        :param str type: `directory`, `notebook` or `file`.
+        :param int size: The file size, `None` for directories.
+        :param float modified: Modification timestamp or `None`.
+        :param float created: Creation timestamp or `None`.
+        """
+        self.name = name
+        self.type = type
+        self.size = size
+        self.modified = modified
+        self.created = created
+
+
+def list_entries(fs, path, log=None):
+    """
+    List a directory using a single scan of its entries with details.
+
+    :param fs: The filesystem to list.
+    :param str path: The directory path.
+    :param log: Logger for entries which cannot be listed.
+    :return list: The `DirectoryEntry` records.
+    """
+    entries = []
+    append = entries.append
+    for info in fs.scandir(path, namespaces=['details']):
+        raw = info.raw
+        name = raw['basic']['name']
+        try:
+            name.encode('utf-8')
+        except UnicodeError as e:
+            if log is not None:
+                log.warning("failed to decode filename %r: %s", name, str(e))
+            continue
+
+        details = raw.get('details', {})
+        if raw['basic']['is_dir']:
+            append(DirectoryEntry(name, _DIRECTORY, None,
+                                  details.get('modified'),
+                                  details.get('created')))
+        else:
+            append(DirectoryEntry(
+                name, _NOTEBOOK if name.endswith('.ipynb') else _FILE,
+                details.get('size'), details.get('modified'),
+                details.get('created')))
+    return entries
+
+
+@functools.lru_cache(maxsize=1024)
+def _guess_mimetype(suffixes):
+    """
+    Guess the MIME type of a file from the suffixes of its name.
+
+    :param str suffixes: The name part starting with the first dot.
+    :return str: The MIME type or `None`.
+    """
+    return mimetypes.guess_type('file' + suffixes)[0]
+
+
+def guess_mimetype(entry):
+    """
+    Guess the MIME type of a directory entry like the contents API does.
+
+    :param DirectoryEntry entry: The entry record.
+    :return str: The MIME type of a file, `None` otherwise.
+    """
+    if entry.type != _FILE:
+        return None
+    dot = entry.name.find('.', 1)
+    return None if dot < 0 else _guess_mimetype(entry.name[dot:])
+
+
+def _datetime(timestamp):
+    """
+    Convert a POSIX timestamp to a UTC datetime.
+
+    :param float timestamp: The timestamp or `None`.
+    :return datetime: The date or `None`.
+    """
+    return None if timestamp is None else epoch_to_datetime(timestamp)
+
+
+def entry_path(path, name):
+    """
+    Build the contents path of a directory entry.
+
+    :param str path: The contents path of the directory.
+    :param str name: The entry name.
+    :return str: The entry path.
+    """
+    return '%s/%s' % (path, name)
+
+
+def entry_model(path, entry):
+    """
+    Build the contents model of a directory entry without content.
+
+    :param str path: The contents path of the directory.
+    :param DirectoryEntry entry: The entry record.
+    :return dict: The entry model.
+    """
+    return {
+        'name': entry.name,
+        'path': entry_path(path, entry.name),
+        'type': entry.type,
+        'last_modified': _datetime(entry.modified),
+        'created': _datetime(entry.created),
+        'content': None,
+        'format': None,
+        'mimetype': guess_mimetype(entry),
+        'size': entry.size,
+        'writable': True,
+    }
+
+
+def _entry_json_model(path, entry):
+    """
+    Build the contents model of a directory entry ready for `json`.
+
+    :param str path: The contents path of the directory.
+    :param DirectoryEntry entry: The entry record.
+    :return dict: The entry model with formatted dates.
+    """
+    return {
+        'name': entry.name,
+        'path': entry_path(path, entry.name),
+        'type': entry.type,
+        'last_modified': _isoformat(entry.modified),
+        'created': _isoformat(entry.created),
+        'content': None,
+        'format': None,
+        'mimetype': guess_mimetype(entry),
+        'size': entry.size,
+        'writable': True,
+    }
+
+
+def iter_listing_json(model, entries, entries_per_chunk=ENTRIES_PER_CHUNK,
+                      default=None):
+    """
+    Serialize a directory model with its listing in chunks.
+
+    The chunks joined together are the JSON of `model` with its content
+    set to the models of `entries`, but only the models of one chunk of
+    entries are built and serialized at a time.
+
+    :param dict model: The directory model without content.
+    :param list entries: `DirectoryEntry` records of the directory.
+    :param int entries_per_chunk: Number of entries in a single chunk.
+    :param default: Function serializing values of `model` which are not
+                    supported by `json`, such as dates.
+    :return: Generator of JSON chunks.
+    """
+    model = dict(model, content=None, format='json')
+    head = json.dumps(model, default=default)
+    marker = '"content": null'
+    split = head.index(marker)
+    path = model['path']
+
+    yield head[:split] + '"content": ['
+    for start in range(0, len(entries), entries_per_chunk):
+        chunk = json.dumps([
+            _entry_json_model(path, entry)
+            for entry in entries[start:start + entries_per_chunk]])
+        yield ('' if start == 0 else ', ') + chunk[1:-1]
+    yield ']' + head[split + len(marker):]
@@ -0,0 +1,323 @@
+# coding: utf-8
+"""Background full-text index of notebook cell sources."""
+
+import sqlite3
+import threading
+import time
+
+from fs.path import join, relpath
+from fs.walk import Walker
+
+import nbformat
+
+from six.moves import queue
+
+from .spaces import MultiSpaceFS
+
+
+def _fts_module(conn):
+    """
+    Detect the best full-text search module supported by SQLite.
+
+    :param conn: Open SQLite connection.
+    :return str: `fts5`, `fts4` or `None` if FTS is not available.
+    """
+    for module in ('fts5', 'fts4'):
+        try:
+            conn.execute(
+                "CREATE VIRTUAL TABLE temp._fts_probe USING %s(x)" % module)
+            conn.execute("DROP TABLE temp._fts_probe")
+            return module
+        except sqlite3.OperationalError:
+            continue
+    return None
+
+
+class NotebookIndex(object):
+    """
+    Local inverted index of notebook cell sources stored in SQLite.
+
+    Notebooks are indexed incrementally, i.e. a notebook is parsed only
+    when its modification time differs from the one recorded in the index.
+    Since the index state is committed after each notebook, an interrupted
+    scan resumes where it stopped on the next run.
+    """
+
+    def __init__(self, contents_manager, db_path, scan_interval=600.0,
+                 throttle=0.05, exclude_dirs=None):
+        """
+        Create the index.
+
+        :param contents_manager: The `OnedataFSContentsManager` whose
+                                 storage should be indexed.
+        :param str db_path: Path to the local SQLite database file.
+        :param float scan_interval: Seconds between full periodic scans.
+        :param float throttle: Seconds to sleep after indexing each notebook.
+        :param list exclude_dirs: Directory name patterns to skip.
+        """
+        self.parent = contents_manager
+        self.log = contents_manager.log
+        self.db_path = db_path
+        self.scan_interval = scan_interval
+        self.throttle = throttle
+        self.exclude_dirs = exclude_dirs or ['.*']
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._fts = _fts_module(self._conn)
+        self._create_schema()
+
+        self._pending = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _create_schema(self):
+        """Create the index tables if they do not exist yet."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS notebooks "
+                "(path TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+            if self._fts == 'fts5':
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS cells USING "
+                    "fts5(path UNINDEXED, cell UNINDEXED, source)")
+            elif self._fts:
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS cells USING "
+                    "fts4(path, cell, source, notindexed=path, "
+                    "notindexed=cell)")
+            else:
+                self.log.warning("SQLite FTS is not available, notebook "
+                                 "search will fall back to substring scan")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS cells "
+                    "(path TEXT, cell INTEGER, source TEXT)")
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS cells_path ON cells(path)")
+
+    def start(self):
+        """Start the background indexing thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        name='onedatafs-notebook-index')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background indexing thread."""
+        self._stop.set()
+        self._pending.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def notify_saved(self, path):
+        """
+        Schedule reindexing of a notebook which has just been saved.
+
+        :param str path: Path to the notebook.
+        """
+        if path.endswith('.ipynb'):
+            self._pending.put(join('/', path))
+
+    def notify_deleted(self, path):
+        """
+        Remove a notebook or a whole directory from the index.
+
+        :param str path: Path to the removed notebook or directory.
+        """
+        path = join('/', path)
+        prefix = path.rstrip('/') + '/'
+        with self._lock, self._conn:
+            for table in ('notebooks', 'cells'):
+                self._conn.execute(
+                    "DELETE FROM %s WHERE path = ? OR "
+                    "substr(path, 1, ?) = ?" % table,
+                    (path, len(prefix), prefix))
+
+    def notify_moved(self, old_path, new_path):
+        """
+        Update paths of a moved notebook or of notebooks in a moved directory.
+
+        A notebook renamed to a name without the `.ipynb` extension is
+        removed from the index.
+
+        :param str old_path: The path before the move.
+        :param str new_path: The path after the move.
+        """
+        old_path = join('/', old_path)
+        new_path = join('/', new_path)
+        prefix = old_path.rstrip('/') + '/'
+        with self._lock, self._conn:
+            for table in ('notebooks', 'cells'):
+                if new_path.endswith('.ipynb'):
+                    self._conn.execute(
+                        "UPDATE %s SET path = ? WHERE path = ?" % table,
+                        (new_path, old_path))
+                else:
+                    self._conn.execute(
+                        "DELETE FROM %s WHERE path = ?" % table,
+                        (old_path,))
+                self._conn.execute(
+                    "UPDATE %s SET path = ? || substr(path, ?) "
+                    "WHERE substr(path, 1, ?) = ?" % table,
+                    (new_path.rstrip('/') + '/', len(prefix) + 1,
+                     len(prefix), prefix))
+
+    def search(self, query, limit=100):
+        """
+        Find notebook cells matching a query.
+
+        :param str query: Whitespace separated terms, all of which must
+                          occur in the cell source.
+        :param int limit: Maximum number of matching cells.
+        :return list: List of dicts with `path` and sorted `cells` indices.
+        """
+        terms = query.split()
+        if not terms:
+            return []
+
+        if self._fts:
+            match = ' '.join('"%s"' % t.replace('"', '""') for t in terms)
+            # Match only cell sources, also in FTS4 tables which index
+            # all columns
+            sql = ("SELECT path, cell FROM cells WHERE %s MATCH ? "
+                   "LIMIT ?" % ('cells' if self._fts == 'fts5'
+                                else 'source'))
+            args = (match, limit)
+        else:
+            sql = ("SELECT path, cell FROM cells WHERE " +
+                   " AND ".join(["instr(source, ?) > 0"] * len(terms)) +
+                   " LIMIT ?")
+            args = tuple(terms) + (limit,)
+
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+
+        results = {}
+        for path, cell in rows:
+            results.setdefault(path, []).append(int(cell))
+        return [{'path': relpath(path), 'cells': sorted(cells)}
+                for path, cells in sorted(results.items())]
+
+    def scan(self):
+        """
+        Walk the storage and reindex modified notebooks.
+
+        In multi space mode only the currently mounted spaces are walked,
+        without postponing their unmounting. Notebooks which are no longer
+        present are removed from the index, but only after the scan
+        completed without being interrupted.
+        """
+        storage = self.parent.background_storage
+        if isinstance(storage.fs, MultiSpaceFS):
+            roots = ['/%s/' % space
+                     for space in storage.fs.mounted_spaces()]
+        else:
+            roots = ['/']
+
+        walker = Walker(filter=['*.ipynb'], exclude_dirs=self.exclude_dirs)
+        seen = set()
+        for root in roots:
+            for path, info in walker.info(storage, root,
+                                          namespaces=['details']):
+                if self._stop.is_set():
+                    return
+                if info.is_dir:
+                    continue
+                seen.add(path)
+                mtime = info.raw['details'].get('modified') or 0.0
+                if self._indexed_mtime(path) != mtime:
+                    self._index(path, mtime, storage)
+                    self._stop.wait(self.throttle)
+
+        with self._lock:
+            indexed = [row[0] for row in self._conn.execute(
+                "SELECT path FROM notebooks")]
+        for path in indexed:
+            if path not in seen and \
+                    any(path.startswith(root) for root in roots):
+                self.notify_deleted(path)
+
+    def _indexed_mtime(self, path):
+        """
+        Get the modification time of a notebook recorded in the index.
+
+        :param str path: Path to the notebook.
+        :return float: The recorded mtime or `None`.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime FROM notebooks WHERE path = ?",
+                (path,)).fetchone()
+        return row[0] if row else None
+
+    def _index(self, path, mtime=None, storage=None):
+        """
+        Parse a notebook and replace its cells in the index.
+
+        :param str path: Path to the notebook.
+        :param float mtime: Modification time of the notebook, fetched
+                            from the storage if not provided.
+        :param storage: The storage client, by default the one of the
+                        contents manager.
+        """
+        path = join('/', path)
+        storage = storage or self.parent.storage
+        try:
+            if mtime is None:
+                mtime = storage.getinfo(
+                    path, namespaces=['details']).raw['details']['modified']
+            content = storage.readbytes(path)
+        except Exception as e:
+            # Keep the indexed cells, the notebook is read again by the
+            # next scan
+            self.log.warning("Cannot read notebook %s: %s", path, e)
+            return
+
+        try:
+            nb = nbformat.reads(content.decode('utf8'), as_version=4)
+            cells = [(path, i, cell.source)
+                     for i, cell in enumerate(nb.cells)]
+        except (ValueError, KeyError, AttributeError,
+                nbformat.ValidationError) as e:
+            # Record the mtime anyway, so that a broken notebook is not
+            # parsed again until it is modified
+            self.log.warning("Cannot index notebook %s: %s", path, e)
+            cells = []
+
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cells WHERE path = ?", (path,))
+            self._conn.executemany(
+                "INSERT INTO cells (path, cell, source) VALUES (?, ?, ?)",
+                cells)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO notebooks (path, mtime) "
+                "VALUES (?, ?)", (path, mtime or 0.0))
+
+        self.log.debug("Indexed %d cells of notebook %s", len(cells), path)
+
+    def _run(self):
+        """Process saved notebooks and run periodic scans until stopped."""
+        next_scan = time.time()
+        while not self._stop.is_set():
+            timeout = max(0.0, next_scan - time.time())
+            try:
+                path = self._pending.get(timeout=timeout)
+            except queue.Empty:
+                path = None
+
+            try:
+                if path is not None:
+                    self._index(path)
+                    self._stop.wait(self.throttle)
+                elif time.time() >= next_scan:
+                    self.log.debug("Starting notebook index scan")
+                    self.scan()
+                    next_scan = time.time() + self.scan_interval
+            except Exception as e:
+                self.log.error("Notebook indexing failed: %s", e,
+                               exc_info=True)
+                next_scan = time.time() + self.scan_interval
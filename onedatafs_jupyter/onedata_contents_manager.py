@@ -2,11 +2,20 @@
 """OnedataFS Jupyter ContentsManager implementation."""
 
 import datetime
-import errno
+import functools
+import hashlib
 import mimetypes
 import os
+import threading
 import time
 import uuid
+from collections import OrderedDict
+
+from fs import errors as fs_errors
+from fs.base import FS
+from fs.path import abspath, basename, dirname, join, splitext
+
+from jupyter_core.paths import jupyter_data_dir
 
 import nbformat
 
@@ -18,10 +27,18 @@ import six
 
 from tornado import web
 
-from traitlets import Any, Bool, Instance, Unicode, default
+from traitlets import Any, Bool, Float, Instance, Integer, Unicode, \
+        default
 
-from fs.onedatafs import OnedataFS, OnedataSubFS  # noqa
-from fs.path import abspath, basename, dirname, join, splitext
+from .archive import ArchiveError, detect_format, extract_archive, \
+        write_archive
+from .changes import ChangeFeed, MetadataCache, is_not_found
+from .listing import entry_model, list_entries
+from .notebook_index import NotebookIndex
+from .resilience import CircuitBreaker, ResilientFS, \
+        StorageTimeoutError, StorageUnavailableError, _in_event_loop
+from .spaces import MultiSpaceFS, SpacePool
+from .transfer import TransferStats
 
 if six.PY3:
     from base64 import encodebytes, decodebytes  # noqa
@@ -29,6 +46,23 @@ else:
     from base64 import encodestring as encodebytes, decodestring as decodebytes
 
 
+def _translate_storage_errors(method):
+    """Report storage errors to clients with proper HTTP status codes."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except fs_errors.ResourceReadOnly as e:
+            raise web.HTTPError(403, u'Permission denied: %s' % e)
+        except StorageTimeoutError as e:
+            self.log.error(u'Storage timeout: %s', e)
+            raise web.HTTPError(504, u'Storage operation timed out: %s' % e)
+        except StorageUnavailableError as e:
+            self.log.error(u'Storage unavailable: %s', e)
+            raise web.HTTPError(503, u'Storage is unavailable: %s' % e)
+    return wrapper
+
+
 class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
     """
     Implements the Jupyter Notebook checkpoints interface.
@@ -56,8 +90,8 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
 
         Returns a checkpoint model for the new checkpoint.
         """
-        if not self.parent.odfs.exists(self._get_checkpoint_dir(path)):
-            self.parent.odfs.makedir(self._get_checkpoint_dir(path))
+        if not self.parent.storage.exists(self._get_checkpoint_dir(path)):
+            self.parent.storage.makedir(self._get_checkpoint_dir(path))
 
         checkpoint_id = str(uuid.uuid4())
         cp = self._get_checkpoint_path(checkpoint_id, path)
@@ -66,8 +100,8 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
         self.parent._save_file(cp, content, format)
         return {
             "id": checkpoint_id,
-            "last_modified":
-                self.parent.odfs.getinfo(cp, namespaces=['details']).modified,
+            "last_modified": self.parent.storage.getinfo(
+                cp, namespaces=['details']).modified,
         }
 
     def create_notebook_checkpoint(self, nb, path):
@@ -79,8 +113,8 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
 
         Returns a checkpoint model for the new checkpoint.
         """
-        if not self.parent.odfs.exists(self._get_checkpoint_dir(path)):
-            self.parent.odfs.makedir(self._get_checkpoint_dir(path))
+        if not self.parent.storage.exists(self._get_checkpoint_dir(path)):
+            self.parent.storage.makedir(self._get_checkpoint_dir(path))
 
         checkpoint_id = str(uuid.uuid4())
         cp = self._get_checkpoint_path(checkpoint_id, path)
@@ -89,8 +123,8 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
         self.parent._save_notebook(cp, nb)
         return {
             "id": checkpoint_id,
-            "last_modified":
-                self.parent.odfs.getinfo(cp, namespaces=['details']).modified,
+            "last_modified": self.parent.storage.getinfo(
+                cp, namespaces=['details']).modified,
         }
 
     def get_file_checkpoint(self, checkpoint_id, path):
@@ -111,7 +145,7 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
         self.log.info("Restoring file %s from checkpoint %s",
                       path, checkpoint_id)
         cp = self._get_checkpoint_path(checkpoint_id, path)
-        if not self.parent.odfs.file_exists(cp):
+        if not self.parent.storage.file_exists(cp):
             raise web.HTTPError(404, u"No such file checkpoint: %s for %s" % (
                 checkpoint_id, path))
         content, format = self.parent._read_file(cp, None)
@@ -138,7 +172,7 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
         self.log.info("Restoring notebook %s from checkpoint %s",
                       path, checkpoint_id)
         cp = self._get_checkpoint_path(checkpoint_id, path)
-        if not self.parent.odfs.exists(cp):
+        if not self.parent.storage.exists(cp):
             raise web.HTTPError(
                 404, u"No such notebook checkpoint: %s for %s" % (
                     checkpoint_id, path))
@@ -188,10 +222,10 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
         checkpoints = []
 
         checkpoint_dir = self._get_checkpoint_dir(path)
-        if not self.parent.odfs.exists(checkpoint_dir):
+        if not self.parent.storage.exists(checkpoint_dir):
             return checkpoints
 
-        checkpoint_dirents = self.parent.odfs.listdir(checkpoint_dir)
+        checkpoint_dirents = self.parent.storage.listdir(checkpoint_dir)
         for file in checkpoint_dirents:
             file_name, checkpoint_id = splitext(file)
 
@@ -207,8 +241,8 @@ class OnedataFSFileCheckpoints(GenericCheckpointsMixin, Checkpoints):
 
             checkpoint_id = checkpoint_id[1:]
 
-            info = self.parent.odfs.getinfo(join(checkpoint_dir, file),
-                                            namespaces=['details'])
+            info = self.parent.storage.getinfo(join(checkpoint_dir, file),
+                                               namespaces=['details'])
             checkpoints.append({
                 "id": str(checkpoint_id),
                 "last_modified": info.modified
@@ -269,6 +303,43 @@ class OnedataFSContentsManager(ContentsManager):
         default_value=''
     )
 
+    connect_on_start = Bool(
+        allow_none=True,
+        config=True,
+        help="""Connect to the Oneprovider in a background thread when the
+                server starts, instead of during the first request.""",
+        default_value=True
+    )
+
+    connect_wait_timeout = Float(
+        allow_none=False,
+        config=True,
+        help="""Seconds for which a request waits for the connection to the
+                Oneprovider before it fails with HTTP 503, connections are
+                never opened on the server thread.""",
+        default_value=2.0
+    )
+
+    multi_space = Bool(
+        allow_none=True,
+        config=True,
+        help="""Expose all spaces accessible with the access token as
+                top-level directories instead of a single `space`. Each
+                space is mounted on first access with a connection
+                restricted to that space, and unmounted after
+                `space_idle_timeout` seconds without use. Spaces are
+                listed with another connection, also closed when idle.""",
+        default_value=False
+    )
+
+    space_idle_timeout = Float(
+        allow_none=False,
+        config=True,
+        help="""Time in seconds after which an unused space is unmounted
+                in multi space mode, 0 keeps spaces mounted.""",
+        default_value=600.0
+    )
+
     insecure = Bool(
         allow_none=True,
         config=True,
@@ -297,25 +368,508 @@ class OnedataFSContentsManager(ContentsManager):
         default_value=False
     )
 
+    adaptive_transfer = Bool(
+        allow_none=True,
+        config=True,
+        help="""Select the data transfer mode per operation based on its
+                size. Smaller transfers and all metadata operations are made
+                via Oneprovider by a buffered client, while transfers of at
+                least `direct_io_threshold` bytes are made directly to the
+                target storage by a separate client.""",
+        default_value=False
+    )
+
+    direct_io_threshold = Integer(
+        allow_none=False,
+        config=True,
+        help='Minimum size in bytes of transfers made in direct IO mode.',
+        default_value=16 * 1024 * 1024
+    )
+
+    archive_compression_level = Integer(
+        allow_none=False,
+        config=True,
+        help="""Compression level from 0 to 9 of exported archives, lower
+                levels trade archive size for export throughput.""",
+        default_value=1
+    )
+
+    archive_workers = Integer(
+        allow_none=False,
+        config=True,
+        help='Number of files written in parallel when importing archives.',
+        default_value=4
+    )
+
+    archive_max_upload_size = Integer(
+        allow_none=False,
+        config=True,
+        help='Maximum size in bytes of an uploaded archive.',
+        default_value=10 * 1024 * 1024 * 1024
+    )
+
     post_save_hook = Any(None, config=True, allow_none=True,
                          help="""Python callable to be called on the path
                                  of a file just saved.""")
 
-    odfs = Instance(OnedataSubFS)
+    index_notebooks = Bool(
+        allow_none=True,
+        config=True,
+        help="""Maintain a local full-text index of notebook cell sources,
+                updated after each save and by periodic background scans.""",
+        default_value=False
+    )
+
+    index_db_path = Unicode(
+        allow_none=True,
+        config=True,
+        help="""Path to the SQLite database storing the notebook index.
+                By default a file in the Jupyter data directory is used.""",
+        default_value=''
+    )
+
+    index_scan_interval = Float(
+        allow_none=False,
+        config=True,
+        help='Interval in seconds between full notebook index scans.',
+        default_value=600.0
+    )
+
+    index_throttle = Float(
+        allow_none=False,
+        config=True,
+        help='Delay in seconds after indexing each notebook.',
+        default_value=0.05
+    )
+
+    trust_cache_size = Integer(
+        allow_none=False,
+        config=True,
+        help="""Number of content hashes of trusted notebooks to remember,
+                so that unchanged notebooks are not re-signed or
+                re-verified on each save and load.""",
+        default_value=256
+    )
+
+    storage_timeout = Float(
+        allow_none=False,
+        config=True,
+        help="""Timeout in seconds of a single OnedataFS operation,
+                0 disables the timeout.""",
+        default_value=30.0
+    )
+
+    storage_min_throughput = Float(
+        allow_none=False,
+        config=True,
+        help="""Minimum expected throughput of data transfers in bytes per
+                second. The timeout of a file read or write is extended by
+                the time needed to transfer the file at this rate, 0
+                disables timeouts of data transfers.""",
+        default_value=1024 * 1024
+    )
+
+    storage_retries = Integer(
+        allow_none=False,
+        config=True,
+        help="""Number of retries of idempotent OnedataFS operations
+                after transient failures, operations made on the server
+                thread are not retried.""",
+        default_value=2
+    )
+
+    storage_retry_backoff = Float(
+        allow_none=False,
+        config=True,
+        help="""Initial backoff in seconds before retrying an operation,
+                doubled on each retry and randomized.""",
+        default_value=0.2
+    )
+
+    storage_retry_backoff_max = Float(
+        allow_none=False,
+        config=True,
+        help='Maximum backoff in seconds before retrying an operation.',
+        default_value=2.0
+    )
+
+    storage_max_workers = Integer(
+        allow_none=False,
+        config=True,
+        help="""Maximum number of concurrent OnedataFS operations, further
+                operations fail immediately.""",
+        default_value=8
+    )
+
+    circuit_failure_threshold = Integer(
+        allow_none=False,
+        config=True,
+        help="""Number of consecutive storage failures after which all
+                operations fail fast, 0 disables the circuit breaker.""",
+        default_value=5
+    )
+
+    circuit_reset_timeout = Float(
+        allow_none=False,
+        config=True,
+        help="""Time in seconds after which an operation is attempted
+                again on a failing storage.""",
+        default_value=30.0
+    )
+
+    metadata_cache_ttl = Float(
+        allow_none=False,
+        config=True,
+        help="""Time in seconds for which file and directory details are
+                cached, 0 disables the cache. When the change feed is
+                enabled, it should be longer than `change_poll_interval`.""",
+        default_value=0.0
+    )
+
+    change_feed = Bool(
+        allow_none=True,
+        config=True,
+        help="""Detect changes of recently accessed or subscribed files and
+                directories with a single shared poller, which refreshes
+                the metadata cache and notifies subscribers of the
+                `/api/onedata/changes` server extension endpoint.""",
+        default_value=False
+    )
+
+    change_poll_interval = Float(
+        allow_none=False,
+        config=True,
+        help='Interval in seconds between polls of each watched path.',
+        default_value=5.0
+    )
+
+    change_watch_lease = Float(
+        allow_none=False,
+        config=True,
+        help="""Time in seconds for which a path is watched for changes
+                after it has been accessed.""",
+        default_value=60.0
+    )
+
+    change_poll_rate = Float(
+        allow_none=False,
+        config=True,
+        help='Maximum number of change polls per second, 0 for no limit.',
+        default_value=20.0
+    )
+
+    odfs = Instance(FS)
+
+    direct_odfs = Instance(FS, allow_none=True)
+
+    storage_breaker = Instance(CircuitBreaker)
+
+    storage = Instance(ResilientFS)
+
+    direct_storage = Instance(ResilientFS, allow_none=True)
+
+    background_storage = Instance(ResilientFS)
+
+    transfer_stats = Instance(TransferStats, args=())
+
+    notebook_index = Instance(NotebookIndex, allow_none=True)
+
+    metadata_cache = Instance(MetadataCache)
+
+    changes = Instance(ChangeFeed, allow_none=True)
+
+    def __init__(self, **kwargs):
+        """Initialize the contents manager and start background services."""
+        self._connect_lock = threading.RLock()
+        self._shared = {}
+        self._ready = threading.Event()
+        self._connect_error = None
+        self._connect_time = None
+        self._connect_start = None
+        self._connector = None
+        self._connector_lock = threading.Lock()
+        super(OnedataFSContentsManager, self).__init__(**kwargs)
+        self._trusted_digests = OrderedDict()
+        if self.connect_on_start:
+            self.connect()
+        if self.index_notebooks:
+            self.notebook_index.start()
+        if self.change_feed:
+            self.changes.start()
+
+    def connect(self):
+        """
+        Connect to the Oneprovider asynchronously.
+
+        Opens all storage connections in a background thread, so that
+        neither the server startup nor the first request have to wait
+        for them. A failed attempt is retried with exponential backoff
+        until the connections are established. Use `readiness` to check
+        the connection state.
+        """
+        with self._connector_lock:
+            if self._connector is not None or self._ready.is_set():
+                return
+            self._connector = threading.Thread(target=self._connect_storage,
+                                               name='onedatafs-connect')
+            self._connector.daemon = True
+            self._connector.start()
+
+    def _connect_storage(self, backoff=1.0, backoff_max=60.0):
+        """
+        Open storage connections, retrying failed attempts.
+
+        The readiness state is recorded by `_create_storage`, also when
+        the storage is connected meanwhile by another thread.
+
+        :param float backoff: Initial retry delay in seconds.
+        :param float backoff_max: Maximum retry delay in seconds.
+        """
+        delay = backoff
+        while True:
+            try:
+                self.storage
+                self.direct_storage
+                return
+            except Exception as e:
+                self.log.error("Cannot connect to Oneprovider %s: %s, "
+                               "retrying in %.0fs", self.oneprovider_host,
+                               e, delay, exc_info=True)
+            time.sleep(delay)
+            delay = min(backoff_max, delay * 2)
+
+    def _create_storage(self, odfs_name):
+        """
+        Connect a guarded storage client and record the connection error.
+
+        :param str odfs_name: Name of the OnedataFS client attribute.
+        :return ResilientFS: The storage client.
+        """
+        if self._connect_start is None:
+            self._connect_start = time.time()
+        try:
+            return self._resilient(getattr(self, odfs_name))
+        except Exception as e:
+            self._connect_error = e
+            raise
+
+    def _record_connected(self):
+        """Mark the manager ready once all storage connections are open."""
+        with self._connect_lock:
+            if self._ready.is_set() or 'storage' not in self._shared or (
+                    self.adaptive_transfer and
+                    'direct_storage' not in self._shared):
+                return
+            self._connect_error = None
+            self._connect_time = time.time() - self._connect_start
+            self._ready.set()
+        self.log.info("Connected to Oneprovider %s in %.2fs",
+                      self.oneprovider_host, self._connect_time)
+
+    def _wait_connected(self):
+        """
+        Wait shortly for the storage connections on the server thread.
+
+        Opening a connection may take long, so requests served before the
+        connections are established start the background connect and fail
+        with HTTP 503 after `connect_wait_timeout` instead of blocking the
+        server.
+        """
+        if self._ready.is_set() or not _in_event_loop():
+            return
+        self.connect()
+        if not self._ready.wait(self.connect_wait_timeout):
+            raise web.HTTPError(
+                503, u'Not connected to Oneprovider %s yet' %
+                self.oneprovider_host)
+
+    def readiness(self):
+        """
+        Report whether the storage connections are established.
+
+        :return dict: `ready` flag, connection `error` if the last attempt
+                      failed and `connect_time` in seconds.
+        """
+        return {
+            'ready': self._ready.is_set(),
+            'error': None if self._connect_error is None
+            else str(self._connect_error),
+            'connect_time': self._connect_time,
+        }
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait until the storage connections are established.
+
+        :param float timeout: Maximum time to wait in seconds.
+        :return bool: Whether the storage is ready.
+        """
+        return self._ready.wait(timeout)
+
+    def _once(self, name, factory):
+        """
+        Create a shared resource exactly once.
+
+        Storage connections may be requested concurrently by the background
+        connect thread and request handlers, this prevents opening them twice.
+
+        :param str name: Name of the resource.
+        :param factory: Callable creating the resource.
+        :return: The resource.
+        """
+        with self._connect_lock:
+            if name not in self._shared:
+                self._shared[name] = factory()
+            return self._shared[name]
+
+    def _connect(self, **options):
+        """
+        Connect to the Oneprovider and open the notebook root directory.
+
+        In multi space mode, the returned filesystem lists all spaces and
+        opens a separate connection to each space on first access.
+
+        :param options: `no_buffer`, `force_proxy_io` and `force_direct_io`
+                        options of the OnedataFS connection.
+        :return FS: The notebook root directory.
+        """
+        if self.multi_space:
+            pool = SpacePool(lambda space: self._open_onedatafs(
+                space=space, **options),
+                             idle_timeout=self.space_idle_timeout,
+                             log=self.log)
+            pool.start()
+            return MultiSpaceFS(pool)
 
-    @default('odfs')
-    def _odfs(self):
         abs_path = join(abspath(self.space), self.path)
+        return self._open_onedatafs(**options).opendir(abs_path)
+
+    def _open_onedatafs(self, no_buffer, force_proxy_io, force_direct_io,
+                        space=None):
+        """
+        Open a new OnedataFS connection to the Oneprovider.
+
+        :param bool no_buffer: Disable internal OnedataFS buffering.
+        :param bool force_proxy_io: Make all transfers via Oneprovider.
+        :param bool force_direct_io: Make all transfers directly to storage.
+        :param str space: Name of the only space mounted by the connection,
+                          by default all user spaces are mounted.
+        :return OnedataFS: The filesystem with the mounted spaces.
+        """
+        from fs.onedatafs import OnedataFS
+
+        options = {}
+        if space is not None:
+            options['space'] = [space]
         return OnedataFS(self.oneprovider_host.encode('ascii', 'replace'),
                          self.access_token.encode('ascii', 'replace'),
-                         no_buffer=self.no_buffer,
-                         force_proxy_io=self.force_proxy_io,
-                         insecure=self.insecure).opendir(abs_path)
+                         no_buffer=no_buffer,
+                         force_proxy_io=force_proxy_io,
+                         force_direct_io=force_direct_io,
+                         insecure=self.insecure,
+                         **options)
+
+    @default('odfs')
+    def _odfs(self):
+        if self.adaptive_transfer:
+            return self._once('odfs', lambda: self._connect(
+                no_buffer=False, force_proxy_io=True, force_direct_io=False))
+        return self._once('odfs', lambda: self._connect(
+            no_buffer=self.no_buffer, force_proxy_io=self.force_proxy_io,
+            force_direct_io=self.force_direct_io))
+
+    @default('direct_odfs')
+    def _direct_odfs(self):
+        if not self.adaptive_transfer:
+            return None
+        return self._once('direct_odfs', lambda: self._connect(
+            no_buffer=self.no_buffer, force_proxy_io=False,
+            force_direct_io=True))
+
+    @default('storage_breaker')
+    def _storage_breaker(self):
+        return CircuitBreaker(
+            failure_threshold=self.circuit_failure_threshold,
+            reset_timeout=self.circuit_reset_timeout)
+
+    def _resilient(self, odfs):
+        """
+        Wrap a OnedataFS client with timeouts, retries and circuit breaker.
+
+        :param odfs: The OnedataFS client.
+        :return ResilientFS: The guarded client.
+        """
+        return ResilientFS(odfs,
+                           timeout=self.storage_timeout,
+                           retries=self.storage_retries,
+                           backoff=self.storage_retry_backoff,
+                           backoff_max=self.storage_retry_backoff_max,
+                           breaker=self.storage_breaker,
+                           max_workers=self.storage_max_workers,
+                           log=self.log,
+                           min_throughput=self.storage_min_throughput)
+
+    @default('storage')
+    def _storage(self):
+        self._wait_connected()
+        storage = self._once('storage',
+                             lambda: self._create_storage('odfs'))
+        self._record_connected()
+        return storage
+
+    @default('direct_storage')
+    def _direct_storage(self):
+        if not self.adaptive_transfer:
+            return None
+        self._wait_connected()
+        storage = self._once('direct_storage',
+                             lambda: self._create_storage('direct_odfs'))
+        self._record_connected()
+        return storage
+
+    @default('background_storage')
+    def _background_storage(self):
+        if not isinstance(self.odfs, MultiSpaceFS):
+            return self.storage
+        return self._once('background_storage', lambda: self._resilient(
+            self.odfs.passive_view()))
+
+    @default('notebook_index')
+    def _notebook_index(self):
+        if not self.index_notebooks:
+            return None
+        db_path = self.index_db_path
+        if not db_path:
+            source = u'%s:%s:%s' % (
+                self.oneprovider_host, self.space, self.path)
+            db_path = os.path.join(
+                jupyter_data_dir(), 'onedatafs-index-%s.sqlite' %
+                hashlib.sha1(source.encode('utf8')).hexdigest()[:16])
+            if not os.path.isdir(os.path.dirname(db_path)):
+                os.makedirs(os.path.dirname(db_path))
+        return NotebookIndex(self, db_path,
+                             scan_interval=self.index_scan_interval,
+                             throttle=self.index_throttle,
+                             exclude_dirs=['.*'])
+
+    @default('metadata_cache')
+    def _metadata_cache(self):
+        return MetadataCache(ttl=self.metadata_cache_ttl)
+
+    @default('changes')
+    def _changes(self):
+        if not self.change_feed:
+            return None
+        return ChangeFeed(self, self.metadata_cache,
+                          interval=self.change_poll_interval,
+                          lease=self.change_watch_lease,
+                          max_polls_per_second=self.change_poll_rate)
 
     @default('checkpoints_class')
     def _checkpoints_class_default(self):
         return OnedataFSFileCheckpoints
 
+    @_translate_storage_errors
     def dir_exists(self, path):
         """
         Check if directory exists.
@@ -323,13 +877,8 @@ class OnedataFSContentsManager(ContentsManager):
         :param str path: The path to check
         :return bool: Whther the directory exists.
         """
-        if not self.odfs.exists(path):
-            return False
-
-        if not self.odfs.isdir(path):
-            return False
-
-        return True
+        info = self._getinfo(path)
+        return info is not None and info.is_dir
 
     def is_hidden(self, path):
         """
@@ -341,6 +890,7 @@ class OnedataFSContentsManager(ContentsManager):
         name = os.path.basename(os.path.abspath(path))
         return name.startswith('.')
 
+    @_translate_storage_errors
     def file_exists(self, path=''):
         """
         Check if regular file exists.
@@ -348,14 +898,43 @@ class OnedataFSContentsManager(ContentsManager):
         :param str path: The path of a file to check for.
         :return bool: Whether the file exists.
         """
-        if not self.odfs.exists(path):
-            return False
+        info = self._getinfo(path)
+        return info is not None and not info.is_dir
 
-        if not self.odfs.isfile(path):
-            return False
+    def _getinfo(self, path):
+        """
+        Get details of a file or directory, using the metadata cache.
 
-        return True
+        :param str path: The path of the file or directory.
+        :return Info: The resource details or `None` if it does not exist.
+        """
+        found, info = self.metadata_cache.get(path)
+        if found:
+            return info
+
+        try:
+            info = self.storage.getinfo(path, namespaces=['details'])
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            if not is_not_found(e):
+                raise
+            info = None
+
+        self.metadata_cache.put(path, info)
+        return info
+
+    def _invalidate(self, path, recursive=False):
+        """
+        Drop cached details of a modified file or directory.
 
+        :param str path: The path of the modified resource.
+        :param bool recursive: Whether to drop details of all resources
+                               below the path.
+        """
+        self.metadata_cache.invalidate(path, recursive=recursive)
+
+    @_translate_storage_errors
     def delete_file(self, path, allow_non_empty=False):
         """
         Delete the file or directory at path.
@@ -363,11 +942,17 @@ class OnedataFSContentsManager(ContentsManager):
         :param str path: The file path to delete.
         :param bool allow_non_empty: Whether to remove non-empty directories.
         """
-        if self.odfs.isdir(path):
-            self.odfs.removetree(path)
+        if self.storage.isdir(path):
+            self.storage.removetree(path)
         else:
-            self.odfs.remove(path)
+            self.storage.remove(path)
+
+        self._invalidate(path, recursive=True)
 
+        if self.notebook_index is not None:
+            self.notebook_index.notify_deleted(path)
+
+    @_translate_storage_errors
     def rename_file(self, old_path, new_path):
         """
         Rename a file or directory.
@@ -375,9 +960,16 @@ class OnedataFSContentsManager(ContentsManager):
         :param str old_path: The file path to rename.
         :param str new_path: The new file path.
         """
-        self.odfs.move(old_path, new_path)
+        self.storage.move(old_path, new_path)
+
+        self._invalidate(old_path, recursive=True)
+        self._invalidate(new_path, recursive=True)
 
-    def _base_model(self, path):
+        if self.notebook_index is not None:
+            self.notebook_index.notify_moved(old_path, new_path)
+            self.notebook_index.notify_saved(new_path)
+
+    def _base_model(self, path, info=None):
         """
         Build the common base of a contents model.
 
@@ -386,14 +978,22 @@ class OnedataFSContentsManager(ContentsManager):
 
         :param str path: The file path for which base model should be
                          created.
+        :param Info info: Details of the file, if already fetched.
         :return dict: The base model
         """
-        try:
-            info = self.odfs.getinfo(path, namespaces=['details'])
+        if info is None:
+            try:
+                info = self._getinfo(path)
+            except StorageUnavailableError:
+                raise
+            except Exception:
+                info = None
+
+        if info is not None:
             size = info.size
             last_modified = info.modified
             created = info.created
-        except Exception:
+        else:
             self.log.warning("Cannot get info of file: %s" % (path))
             size = None
             created = datetime.datetime.now()
@@ -419,7 +1019,7 @@ class OnedataFSContentsManager(ContentsManager):
 
         return model
 
-    def _dir_model(self, path, content=True):
+    def _dir_model(self, path, content=True, info=None):
         """
         Build a model for a directory.
 
@@ -428,43 +1028,53 @@ class OnedataFSContentsManager(ContentsManager):
         :param str path: The path of the directory.
         :param str content: Whether the result should include contents of
                             an existing directory.
+        :param Info info: Details of the directory, if already fetched.
         :return dict: Directory model.
         """
-        if not self.odfs.isdir(path):
+        if info is None:
+            info = self._getinfo(path)
+        if info is None or not info.is_dir:
             raise web.HTTPError(404, u'directory does not exist: %r' % path)
 
-        model = self._base_model(path)
+        model = self._base_model(path, info)
         model['type'] = 'directory'
         model['size'] = None
         if content:
-            model['content'] = contents = []
-            for name in self.odfs.listdir(path):
-                try:
-                    entry_path = join(path, name)
-                except UnicodeDecodeError as e:
-                    self.log.warning(
-                        "failed to decode filename '%s': %s", name, str(e))
-                    continue
-
-                try:
-                    self.odfs.getinfo(entry_path)
-                except OSError as e:
-                    if e.errno == errno.ENOENT:
-                        self.log.warning(
-                            "%s directory doesn't exist", entry_path)
-                    else:
-                        self.log.warning("Cannot stat %s: %s",
-                                         entry_path, str(e))
-                    continue
-
-                contents.append(self.get(path='%s/%s' %
-                                         (path, name), content=False))
-
+            model['content'] = [entry_model(path, entry)
+                                for entry in self._list_entries(path)]
             model['format'] = 'json'
 
         return model
 
-    def _file_model(self, path, content=True, format=None):
+    def _list_entries(self, path):
+        """
+        List a directory as compact records using a single storage scan.
+
+        :param str path: The path of the directory.
+        :return list: The `DirectoryEntry` records of its entries.
+        """
+        return self.storage.transfer('scandir', path, None, list_entries,
+                                     self.storage.fs, path, self.log)
+
+    @_translate_storage_errors
+    def list_directory(self, path):
+        """
+        Get a directory model and its listing as compact records.
+
+        Used to stream large listings, the entry models are serialized
+        from the records by `listing.iter_listing_json`.
+
+        :param str path: The path of the directory.
+        :return tuple: The directory model without content and the list
+                       of `DirectoryEntry` records.
+        """
+        if self.changes is not None:
+            self.changes.touch(path)
+
+        model = self._dir_model(path, content=False)
+        return model, self._list_entries(path)
+
+    def _file_model(self, path, content=True, format=None, info=None):
         """
         Build a model for a file.
 
@@ -477,15 +1087,17 @@ class OnedataFSContentsManager(ContentsManager):
                            will be utf-8 decoded, if `'base64'` the binary byte
                            array will be returned, if `None` than try to decode
                            utf-8 and if that fails return raw bytes.
+        :param Info info: Details of the file, if already fetched.
         :return dict: The file model.
         """
-        model = self._base_model(path)
+        model = self._base_model(path, info)
         model['type'] = 'file'
 
         model['mimetype'] = mimetypes.guess_type(path)[0]
 
         if content:
-            content, format = self._read_file(path, format)
+            content, format = self._read_file(path, format,
+                                              size=model['size'], info=info)
             if model['mimetype'] is None:
                 default_mime = {
                     'text': 'text/plain',
@@ -500,27 +1112,31 @@ class OnedataFSContentsManager(ContentsManager):
 
         return model
 
-    def _notebook_model(self, path, content=True):
+    def _notebook_model(self, path, content=True, info=None):
         """
         Build a notebook model.
 
         :param str path: The path to the notebook.
         :param bool content: Whether to include in the response the notebook
                              contents.
+        :param Info info: Details of the notebook, if already fetched.
         :return dict: The notebook model.
         """
-        model = self._base_model(path)
+        model = self._base_model(path, info)
         model['type'] = 'notebook'
 
         if content:
-            nb = self._read_notebook(path, as_version=4)
-            self.mark_trusted_cells(nb, path)
+            nb_bytes = self._read_bytes(path, size=model['size'])
+            nb = self._decode_notebook(path, nb_bytes, as_version=4)
+            self.mark_trusted_cells(nb, path,
+                                    digest=self._notebook_digest(nb_bytes))
             model['content'] = nb
             model['format'] = 'json'
             self.validate_notebook_model(model)
 
         return model
 
+    @_translate_storage_errors
     def get(self, path, content=True, type=None, format=None):
         """
         Get the model of a file, directory or notebook.
@@ -532,24 +1148,42 @@ class OnedataFSContentsManager(ContentsManager):
         :return dict: The resource model. If content=True, returns the contents
                       of the file, notebook or directory.
         """
-        if not self.exists(path):
+        if self.changes is not None:
+            self.changes.touch(path)
+
+        return self._get_model(path, content=content, type=type,
+                               format=format)
+
+    def _get_model(self, path, content=True, type=None, format=None):
+        """
+        Get the model of a file, directory or notebook.
+
+        :param str path: The path to the resource.
+        :param bool content: Whether to include the contents in the response
+        :param str type: 'file', 'notebook', or 'directory'.
+        :param str format: 'text' or 'base64'.
+        :return dict: The resource model.
+        """
+        info = self._getinfo(path)
+        if info is None:
             raise web.HTTPError(404, u'No such file or directory: %s' % path)
 
-        if self.odfs.isdir(path):
+        if info.is_dir:
             if type not in (None, 'directory'):
                 raise web.HTTPError(
                         400, u'%s is a directory, not a %s' % (path, type),
                         reason='bad type')
-            model = self._dir_model(path, content=content)
+            model = self._dir_model(path, content=content, info=info)
         elif type == 'notebook' or (type is None and path.endswith('.ipynb')):
             self.log.debug("Getting notebook from file %s" % (path))
-            model = self._notebook_model(path, content=content)
+            model = self._notebook_model(path, content=content, info=info)
         else:
             if type == 'directory':
                 raise web.HTTPError(
                         400, u'%s is not a directory' % path,
                         reason='bad type')
-            model = self._file_model(path, content=content, format=format)
+            model = self._file_model(path, content=content, format=format,
+                                     info=info)
         return model
 
     def _save_directory(self, path, model, spath=''):
@@ -560,13 +1194,15 @@ class OnedataFSContentsManager(ContentsManager):
         :param dict model: Model of the directory.
         :param str spath: Not used.
         """
-        if not self.odfs.exists(path):
-            self.odfs.makedir(path)
-        elif not self.odfs.isdir(path):
+        if not self.storage.exists(path):
+            self.storage.makedir(path)
+            self._invalidate(path)
+        elif not self.storage.isdir(path):
             raise web.HTTPError(400, u'Not a directory: %s' % (path))
         else:
             self.log.warning("Directory %r already exists", path)
 
+    @_translate_storage_errors
     def save(self, model, path=''):
         """
         Save the file model and return the model without the content.
@@ -587,8 +1223,9 @@ class OnedataFSContentsManager(ContentsManager):
         try:
             if model['type'] == 'notebook':
                 notebook = nbformat.from_dict(model['content'])
-                self.check_and_sign(notebook, path)
-                self._save_notebook(path, notebook)
+                nb_bytes = self._serialize_notebook(notebook)
+                self.check_and_sign(notebook, path, nb_bytes=nb_bytes)
+                self._save_notebook(path, notebook, nb_bytes=nb_bytes)
             elif model['type'] == 'file':
                 self._save_file(path, model['content'], model.get('format'))
             elif model['type'] == 'directory':
@@ -596,7 +1233,8 @@ class OnedataFSContentsManager(ContentsManager):
             else:
                 raise web.HTTPError(
                         400, "Unhandled contents type: %s" % model['type'])
-        except web.HTTPError:
+        except (web.HTTPError, StorageUnavailableError,
+                fs_errors.ResourceReadOnly):
             raise
         except Exception as e:
             self.log.error(u'Error while saving file: %s %s', path, e,
@@ -617,10 +1255,13 @@ class OnedataFSContentsManager(ContentsManager):
 
         self.run_post_save_hook(model=model, os_path=path)
 
+        if self.notebook_index is not None and model['type'] == 'notebook':
+            self.notebook_index.notify_saved(path)
+
         # Update the creation date in the notebook model, in case the
         # Oneprovider has a time shift of few seconds with respect to th
         # client machine
-        model['last_modified'] = self.odfs.getinfo(
+        model['last_modified'] = self.storage.getinfo(
                 path, namespaces=['details']).modified
 
         return model
@@ -649,10 +1290,85 @@ class OnedataFSContentsManager(ContentsManager):
                 400, u'Encoding error saving %s: %s' % (path, e)
             )
 
-        if not self.odfs.exists(path):
-            self.odfs.create(path)
+        if not self.storage.exists(path):
+            self.storage.create(path)
+
+        self._write_bytes(path, bcontent)
+
+    def _transfer_route(self, size):
+        """
+        Select the OnedataFS client for a data transfer.
+
+        :param int size: Number of bytes to transfer, if known.
+        :return tuple: The route name and the storage client.
+        """
+        if self.direct_storage is None:
+            return 'default', self.storage
+
+        if size is not None and size >= self.direct_io_threshold:
+            return 'direct', self.direct_storage
 
-        with self.odfs.openbin(path, 'rw+') as f:
+        return 'proxy', self.storage
+
+    def _record_transfer(self, route, direction, path, size, start):
+        """
+        Record statistics of a completed data transfer.
+
+        :param str route: The route used for the transfer.
+        :param str direction: `read` or `write`.
+        :param str path: The transferred file path.
+        :param int size: Number of transferred bytes.
+        :param float start: Transfer start timestamp.
+        """
+        duration = time.time() - start
+        self.transfer_stats.record(route, direction, size, duration)
+        self.log.debug("Transfer %s of %s (%d bytes) via %s took %.3fs",
+                       direction, path, size, route, duration)
+
+    def _read_bytes(self, path, size=None):
+        """
+        Read the whole contents of a file.
+
+        :param str path: The path to the file.
+        :param int size: The file size, if known.
+        :return bytes: The file contents.
+        """
+        if size is None:
+            info = self._getinfo(path)
+            size = info.size if info is not None else None
+
+        route, storage = self._transfer_route(size)
+        start = time.time()
+        bcontent = storage.transfer('readbytes', path, size,
+                                    storage.fs.readbytes, path)
+        self._record_transfer(route, 'read', path, len(bcontent), start)
+        return bcontent
+
+    def _write_bytes(self, path, bcontent):
+        """
+        Overwrite an existing file with the given contents.
+
+        :param str path: The path to the file.
+        :param bytes bcontent: The file contents.
+        """
+        route, storage = self._transfer_route(len(bcontent))
+        start = time.time()
+        try:
+            storage.transfer('write', path, len(bcontent), self._write_file,
+                             storage.fs, path, bcontent)
+        finally:
+            self._invalidate(path)
+        self._record_transfer(route, 'write', path, len(bcontent), start)
+
+    def _write_file(self, odfs, path, bcontent):
+        """
+        Write contents to an existing file using a OnedataFS client.
+
+        :param odfs: The OnedataFS client.
+        :param str path: The path to the file.
+        :param bytes bcontent: The file contents.
+        """
+        with odfs.openbin(path, 'rw+') as f:
             f.write(bcontent)
 
     def _read_notebook(self, path, as_version=4):
@@ -663,73 +1379,180 @@ class OnedataFSContentsManager(ContentsManager):
         :param as_version: Specify the notebook version.
         :return dict: The notebook model with contents.
         """
+        return self._decode_notebook(path, self._read_bytes(path),
+                                     as_version=as_version)
+
+    def _decode_notebook(self, path, nb_bytes, as_version=4):
+        """
+        Decode a notebook read from a path.
+
+        :param str path: Path to the notebook, used for logging.
+        :param bytes nb_bytes: The serialized notebook.
+        :param as_version: Specify the notebook version.
+        :return dict: The notebook model with contents.
+        """
         try:
-            nb_bytes = self.odfs.readbytes(path)
             notebook = nbformat.reads(nb_bytes.decode('utf8'),
                                       as_version=as_version)
-            self.log.warning("Decoded notebook from file: %s", notebook)
+            self.log.debug("Decoded notebook from file: %s", path)
             return notebook
         except Exception as e:
-            self.log.error("Cannot read notebook %s",
-                           str(nb_bytes.decode('utf8')))
+            self.log.error("Cannot read notebook %s: %s", path, e)
             raise e
 
-    def _save_notebook(self, path, nb):
+    def _serialize_notebook(self, nb):
+        """
+        Serialize a notebook to bytes in its current nbformat version.
+
+        :param dict nb: The notebook model.
+        :return bytes: The utf-8 encoded notebook JSON.
+        """
+        nb_string = nbformat.writes(
+                nb, version=nbformat.NO_CONVERT).encode('utf8')
+
+        if six.PY2:
+            return bytes(nb_string)
+
+        return nb_string
+
+    def _notebook_digest(self, nb_bytes):
+        """
+        Compute the content hash of a serialized notebook.
+
+        :param bytes nb_bytes: The serialized notebook.
+        :return str: Hex digest identifying the notebook contents.
+        """
+        return hashlib.sha256(nb_bytes).hexdigest()
+
+    def _remember_trusted(self, digest):
+        """
+        Record that notebook contents with given hash are signed.
+
+        :param str digest: The notebook content hash.
+        """
+        self._trusted_digests[digest] = True
+        self._trusted_digests.move_to_end(digest)
+        while len(self._trusted_digests) > self.trust_cache_size:
+            self._trusted_digests.popitem(last=False)
+
+    def _is_known_trusted(self, digest):
+        """
+        Check whether notebook contents with given hash are known signed.
+
+        :param str digest: The notebook content hash.
+        :return bool: Whether the contents were signed or verified before.
+        """
+        if digest not in self._trusted_digests:
+            return False
+
+        self._trusted_digests.move_to_end(digest)
+        return True
+
+    def check_and_sign(self, nb, path='', nb_bytes=None):
+        """
+        Check for trusted cells, and sign the notebook.
+
+        The notebook is not signed again if the same contents have already
+        been signed or verified, which avoids computing the HMAC over the
+        whole notebook on every autosave.
+
+        :param dict nb: The notebook model.
+        :param str path: The notebook path, used for logging.
+        :param bytes nb_bytes: The serialized notebook, if already available.
+        """
+        if nb_bytes is None:
+            nb_bytes = self._serialize_notebook(nb)
+        digest = self._notebook_digest(nb_bytes)
+
+        if self._is_known_trusted(digest):
+            return
+
+        if self.notary.check_cells(nb):
+            self.notary.sign(nb)
+            # Cells carrying the transient `trusted` flag are signed
+            # differently than they will be read back, so only remember
+            # signatures of notebooks which match their serialized form
+            if not any('trusted' in cell.get('metadata', {})
+                       for cell in nb.get('cells', [])):
+                self._remember_trusted(digest)
+        else:
+            self.log.warning("Notebook %s is not trusted", path)
+
+    def mark_trusted_cells(self, nb, path='', digest=None):
+        """
+        Mark cells as trusted if the notebook signature matches.
+
+        :param dict nb: The notebook model.
+        :param str path: The notebook path, used for logging.
+        :param str digest: Content hash of the serialized notebook, if
+                           provided the signature check result is cached.
+        """
+        if digest is not None and self._is_known_trusted(digest):
+            self.notary.mark_cells(nb, True)
+            return
+
+        trusted = self.notary.check_signature(nb)
+        if not trusted:
+            self.log.warning("Notebook %s is not trusted", path)
+        elif digest is not None:
+            self._remember_trusted(digest)
+        self.notary.mark_cells(nb, trusted)
+
+    def _save_notebook(self, path, nb, nb_bytes=None):
         """
         Save a notebook to a path.
 
         :param str path: The path to the notebook.
         :param dict nb: The notebook model.
+        :param bytes nb_bytes: The serialized notebook, if already available.
         """
         self.log.warning("Saving notebook model %s (ts=%s)", path, time.time())
 
         try:
-            nb_string = nbformat.writes(
-                    nb, version=nbformat.NO_CONVERT).encode('utf8')
-
-            if six.PY2:
-                nb_bytes = bytes(nb_string)
-            else:
-                nb_bytes = nb_string
+            if nb_bytes is None:
+                nb_bytes = self._serialize_notebook(nb)
 
-            self.odfs.create(path, wipe=True)
+            self.storage.create(path, wipe=True)
 
-            truncated_size = len(self.odfs.readbytes(path))
+            truncated_size = len(self.storage.readbytes(path))
             if truncated_size > 0:
                 self.log.error("File %s not empty after truncate: %d!!!",
                                path, truncated_size)
 
-            self.odfs.writebytes(path, nb_bytes)
+            self._write_bytes(path, nb_bytes)
 
             # Update the notebook mtime to subsecond accuracy
             # to avoid the warning about the notebook being changed on disk
-            self.odfs.setinfo(path, {'details': {'modified': time.time()}})
+            self.storage.setinfo(path, {'details': {'modified': time.time()}})
+            self._invalidate(path)
 
             self.log.debug("Notebook saved at: %s" % (
                 str(datetime.datetime.now())))
             self.log.debug("Notebook file modified date: %s" % (
-                str(self.odfs.getinfo(path, namespaces=['details']).modified)))
+                str(self.storage.getinfo(
+                    path, namespaces=['details']).modified)))
         except ValueError as error:
-            self.log.error("Tried to save invalid JSON to model: %s",
-                           nb_string.decode('utf8'))
+            self.log.error("Tried to save invalid JSON to model: %s", path)
             raise error
         except TypeError as error:
-            self.log.error("Failed encoding the model: %s",
-                           str(nb_string))
+            self.log.error("Failed encoding the model: %s", path)
             raise error
 
-    def _read_file(self, path, format):
+    def _read_file(self, path, format, size=None, info=None):
         """
         Read a regular file.
 
         :param str path: Path to the notebook.
         :param str format: `text` or `base64`.
+        :param int size: The file size, if known.
+        :param Info info: Details of the file, if already fetched.
         """
-        if not self.odfs.isfile(path):
+        if info is None:
+            info = self._getinfo(path)
+        if info is None or info.is_dir:
             raise web.HTTPError(400, "Cannot read non-file %s" % path)
 
-        with self.odfs.openbin(path, 'r') as f:
-            bcontent = f.read()
+        bcontent = self._read_bytes(path, size=size)
 
         if format is None or format == 'text':
             # Try to interpret as unicode if format is unknown or if unicode
@@ -745,6 +1568,71 @@ class OnedataFSContentsManager(ContentsManager):
                     )
         return encodebytes(bcontent).decode('ascii'), 'base64'
 
+    @_translate_storage_errors
+    def export_archive(self, path, fileobj, format='zip'):
+        """
+        Write a directory tree as an archive to a file object.
+
+        :param str path: The directory to export.
+        :param fileobj: Writable, possibly non-seekable, file object.
+        :param str format: `zip` or `tar.gz`.
+        """
+        if not self.dir_exists(path):
+            raise web.HTTPError(404, u'No such directory: %s' % path)
+
+        try:
+            write_archive(self.storage, path, fileobj, format,
+                          compresslevel=self.archive_compression_level)
+        except ArchiveError as e:
+            raise web.HTTPError(400, u'%s' % e)
+
+    @_translate_storage_errors
+    def import_archive(self, path, fileobj, format=None):
+        """
+        Extract an archive into a directory.
+
+        :param str path: The target directory, created if necessary.
+        :param fileobj: Seekable file object with the archive.
+        :param str format: `zip` or `tar.gz`, detected if not provided.
+        :return dict: The model of the target directory without content.
+        """
+        if format is None:
+            format = detect_format(fileobj)
+            if format is None:
+                raise web.HTTPError(400, u'Unknown archive format')
+
+        if self.file_exists(path):
+            raise web.HTTPError(400, u'Not a directory: %s' % path)
+
+        self.log.info("Importing %s archive into %s", format, path)
+        try:
+            files = extract_archive(self.storage, path, fileobj, format,
+                                    workers=self.archive_workers)
+        except ArchiveError as e:
+            raise web.HTTPError(400, u'%s' % e)
+        finally:
+            self._invalidate(path, recursive=True)
+
+        if self.notebook_index is not None:
+            for file_path in files:
+                self.notebook_index.notify_saved(file_path)
+
+        return self.get(path, content=False)
+
+    def search_notebooks(self, query, limit=100):
+        """
+        Search the notebook index for cells containing all query terms.
+
+        :param str query: Whitespace separated search terms.
+        :param int limit: Maximum number of matching cells.
+        :return list: List of dicts with notebook `path` and matching
+                      `cells` indices.
+        """
+        if self.notebook_index is None:
+            raise web.HTTPError(400, u'Notebook indexing is not enabled')
+
+        return self.notebook_index.search(query, limit=limit)
+
     def run_post_save_hook(self, model, os_path):
         """
         Run the post-save hook if defined, and log errors.
@@ -0,0 +1,363 @@
+# coding: utf-8
+"""Timeouts, retries and circuit breaking for OnedataFS operations."""
+
+import asyncio
+import errno
+import logging
+import random
+import threading
+import time
+from concurrent import futures
+
+from fs import errors as fs_errors
+
+#: Operations which can be safely retried after a failure to reach the
+#: storage
+IDEMPOTENT_OPERATIONS = frozenset([
+    'exists', 'isdir', 'isfile', 'getinfo', 'getdetails', 'getsize',
+    'listdir', 'scandir', 'filterdir', 'readbytes', 'readtext',
+])
+
+#: Operations returning lazy iterators, which are consumed in the worker
+LISTING_OPERATIONS = frozenset(['scandir', 'filterdir'])
+
+#: Operations modifying the storage, executed at most once
+MUTATING_OPERATIONS = frozenset([
+    'makedir', 'makedirs', 'create', 'remove', 'removedir', 'removetree',
+    'move', 'copy', 'writebytes', 'writetext', 'setinfo', 'settimes',
+    'openbin',
+])
+
+TRANSIENT_ERRNOS = frozenset([
+    errno.EAGAIN, errno.EIO, errno.ETIMEDOUT, errno.ECONNABORTED,
+    errno.ECONNREFUSED, errno.ECONNRESET, errno.EHOSTUNREACH,
+    errno.ENETUNREACH,
+])
+
+
+class StorageUnavailableError(Exception):
+    """The storage cannot currently serve requests."""
+
+
+class StorageTimeoutError(StorageUnavailableError):
+    """A storage operation did not complete within the timeout."""
+
+
+class CircuitOpenError(StorageUnavailableError):
+    """The storage is failing fast after repeated failures."""
+
+
+def is_transient(error):
+    """
+    Check whether an error is likely caused by a degraded storage.
+
+    :param Exception error: The error raised by a storage operation.
+    :return bool: Whether the operation may succeed when retried.
+    """
+    if isinstance(error, StorageTimeoutError):
+        return True
+
+    if isinstance(error, (fs_errors.RemoteConnectionError,
+                          fs_errors.OperationTimeout)):
+        return True
+
+    if isinstance(error, EnvironmentError):
+        return getattr(error, 'errno', None) in TRANSIENT_ERRNOS
+
+    return False
+
+
+def is_retryable(error):
+    """
+    Check whether an operation failed without reaching the storage.
+
+    Timeouts are not retryable, since the abandoned operation may still be
+    running and retrying it would only add to the load of a slow storage.
+
+    :param Exception error: The error raised by a storage operation.
+    :return bool: Whether the operation can be safely retried.
+    """
+    if isinstance(error, fs_errors.RemoteConnectionError):
+        return True
+
+    if isinstance(error, EnvironmentError):
+        return getattr(error, 'errno', None) in TRANSIENT_ERRNOS \
+            and getattr(error, 'errno', None) != errno.ETIMEDOUT
+
+    return False
+
+
+def _in_event_loop():
+    """
+    Check whether the calling thread runs an event loop.
+
+    :return bool: Whether blocking the thread would block the server.
+    """
+    get_running_loop = getattr(asyncio, '_get_running_loop', None)
+    return get_running_loop is not None and get_running_loop() is not None
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker tracking consecutive storage failures.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    all operations fail fast. After `reset_timeout` seconds a single trial
+    operation is let through, which closes the circuit on success or opens
+    it again on failure.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        """
+        Create a closed circuit breaker.
+
+        :param int failure_threshold: Consecutive failures opening the
+                                      circuit, 0 disables the breaker.
+        :param float reset_timeout: Seconds after which a trial operation
+                                    is allowed on an open circuit.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Check whether an operation may be attempted.
+
+        :return bool: False if the operation should fail fast.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # Let a new trial through also if the previous one never
+            # reported back
+            if time.time() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        """Record an operation which reached the storage."""
+        with self._lock:
+            self._failures = 0
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        """Record a transient failure of an operation."""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.failure_threshold and
+                    self._failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.time()
+
+
+class ResilientFS(object):
+    """
+    Proxy to a PyFilesystem instance guarding each operation.
+
+    Every storage operation is executed in a bounded pool of worker
+    threads and abandoned after `timeout` seconds, which for data
+    transfers is extended according to their size. Since a blocked
+    oneclient call cannot be interrupted, a worker stays occupied until
+    the call returns, and when all workers are occupied new operations
+    fail immediately instead of queueing. Until an abandoned modification
+    of a path returns, further modifications of that path fail too.
+    Idempotent operations which failed to reach the storage are retried
+    with jittered exponential backoff, except on the event loop thread,
+    which must not sleep and where such operations are not retried.
+    """
+
+    def __init__(self, fs, timeout=30.0, retries=2, backoff=0.2,
+                 backoff_max=2.0, breaker=None, max_workers=8, log=None,
+                 min_throughput=1024 * 1024):
+        """
+        Wrap a filesystem.
+
+        :param fs: The wrapped PyFilesystem instance.
+        :param float timeout: Timeout of a single operation attempt in
+                              seconds, 0 disables timeouts.
+        :param int retries: Number of retries of idempotent operations.
+        :param float backoff: Initial retry backoff in seconds.
+        :param float backoff_max: Maximum retry backoff in seconds.
+        :param CircuitBreaker breaker: Circuit breaker, possibly shared
+                                       with other proxies.
+        :param int max_workers: Maximum number of concurrent operations.
+        :param log: Logger instance.
+        :param float min_throughput: Minimum expected throughput of data
+                                     transfers in bytes per second, 0
+                                     disables timeouts of transfers.
+        """
+        self.fs = fs
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.log = log or logging.getLogger(__name__)
+        self.min_throughput = min_throughput
+        self._busy_paths = set()
+        self._busy_lock = threading.Lock()
+        self._executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def __getattr__(self, name):
+        """Return guarded storage operations and plain other attributes."""
+        attr = getattr(self.fs, name)
+        if name not in IDEMPOTENT_OPERATIONS and \
+                name not in MUTATING_OPERATIONS:
+            return attr
+
+        if name in LISTING_OPERATIONS:
+            def operation(*args, **kwargs):
+                return self.call(name, lambda: list(attr(*args, **kwargs)))
+        elif name in MUTATING_OPERATIONS:
+            def operation(*args, **kwargs):
+                path = args[0] if args else kwargs.get('path')
+                return self._call(name, attr, args, kwargs, self.timeout,
+                                  path)
+        else:
+            def operation(*args, **kwargs):
+                return self.call(name, attr, *args, **kwargs)
+        return operation
+
+    def call(self, operation, fn, *args, **kwargs):
+        """
+        Execute a storage operation with timeout, retries and breaker.
+
+        :param str operation: Operation name, determines whether it can
+                              be retried.
+        :param fn: Callable performing the operation.
+        :return: The result of the operation.
+        """
+        return self._call(operation, fn, args, kwargs, self.timeout)
+
+    def transfer(self, operation, path, size, fn, *args, **kwargs):
+        """
+        Execute a data transfer with a timeout depending on its size.
+
+        The fixed `timeout` is extended by the time needed to transfer
+        `size` bytes at `min_throughput`, transfers of unknown size, such
+        as directory listings, are limited by the fixed `timeout` only.
+
+        :param str operation: Operation name, determines whether it can
+                              be retried.
+        :param str path: The transferred file path, further writes of
+                         which fail while an abandoned write is running.
+        :param int size: Number of transferred bytes or `None` if unknown.
+        :param fn: Callable performing the transfer.
+        :return: The result of the transfer.
+        """
+        timeout = self.timeout
+        if timeout and size is not None:
+            if not self.min_throughput:
+                timeout = None
+            else:
+                timeout += float(size) / self.min_throughput
+        if operation in IDEMPOTENT_OPERATIONS:
+            path = None
+        return self._call(operation, fn, args, kwargs, timeout, path)
+
+    def _call(self, operation, fn, args, kwargs, timeout, path=None):
+        """
+        Execute a storage operation with retries and breaker.
+
+        :param str operation: Operation name.
+        :param fn: Callable performing the operation.
+        :param tuple args: Positional arguments of `fn`.
+        :param dict kwargs: Keyword arguments of `fn`.
+        :param float timeout: Timeout of a single attempt or `None`.
+        :param str path: Path modified by the operation, if any.
+        :return: The result of the operation.
+        """
+        attempts = 1
+        if operation in IDEMPOTENT_OPERATIONS and not _in_event_loop():
+            attempts += max(0, self.retries)
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                raise CircuitOpenError(
+                    'Storage circuit is open, %s not attempted' % operation)
+            try:
+                result = self._attempt(operation, fn, args, kwargs, timeout,
+                                       path)
+            except Exception as e:
+                if not is_transient(e):
+                    if not isinstance(e, StorageUnavailableError):
+                        self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if not is_retryable(e) or attempt + 1 == attempts:
+                    raise
+                delay = random.uniform(
+                    0, min(self.backoff_max, self.backoff * 2 ** attempt))
+                self.log.warning("Storage operation %s failed: %s, "
+                                 "retrying in %.2fs", operation, e, delay)
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _attempt(self, operation, fn, args, kwargs, timeout, path=None):
+        """
+        Run a single attempt of an operation in a worker thread.
+
+        :param str operation: Operation name used in error messages.
+        :param fn: Callable performing the operation.
+        :param tuple args: Positional arguments of `fn`.
+        :param dict kwargs: Keyword arguments of `fn`.
+        :param float timeout: Timeout in seconds or `None`.
+        :param str path: Path modified by the operation, if any.
+        :return: The result of the operation.
+        """
+        if not self.timeout:
+            return fn(*args, **kwargs)
+
+        with self._busy_lock:
+            if path is not None and path in self._busy_paths:
+                raise StorageUnavailableError(
+                    'A previous modification of %s is still in progress, '
+                    '%s not attempted' % (path, operation))
+
+        if not self._slots.acquire(False):
+            raise StorageUnavailableError(
+                'All storage workers are busy, %s not attempted' % operation)
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=timeout)
+        except futures.TimeoutError:
+            if path is not None:
+                self._mark_busy(path, future)
+            raise StorageTimeoutError(
+                'Storage operation %s timed out after %.1fs' % (
+                    operation, timeout))
+
+    def _mark_busy(self, path, future):
+        """
+        Reject modifications of a path until an abandoned one completes.
+
+        :param str path: The modified path.
+        :param future: The future of the abandoned operation.
+        """
+        def done(_):
+            with self._busy_lock:
+                self._busy_paths.discard(path)
+
+        with self._busy_lock:
+            self._busy_paths.add(path)
+        future.add_done_callback(done)
@@ -0,0 +1,478 @@
+# coding: utf-8
+"""Access to all spaces of a user through lazily opened connections."""
+
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from fs import errors
+from fs.base import FS
+from fs.info import Info
+from fs.move import move_dir
+from fs.path import abspath, iteratepath, normpath
+
+
+class SpacePool(object):
+    """
+    Pool of OnedataFS connections opened lazily per space.
+
+    A connection is opened on the first access to a space and closed
+    after it has not been used for `idle_timeout` seconds, so that the
+    number of oneclient instances follows the number of active spaces.
+    The connection used for listing spaces is pooled under the `None` key.
+    """
+
+    def __init__(self, connect, idle_timeout=600.0, log=None):
+        """
+        Create an empty pool.
+
+        :param connect: Callable returning a new OnedataFS connection,
+                        called with the space name or `None`.
+        :param float idle_timeout: Seconds after which an unused
+                                   connection is closed, 0 keeps
+                                   connections open.
+        :param log: Logger instance.
+        """
+        self.connect = connect
+        self.idle_timeout = idle_timeout
+        self.log = log or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._space_locks = {}
+        self._connections = {}
+        self._last_used = {}
+        self._users = {}
+        self._stop = threading.Event()
+        self._reaper = None
+
+    @contextmanager
+    def use(self, space, passive=False):
+        """
+        Get a connection to a space, preventing it from being closed.
+
+        :param str space: The space name or `None` for the root connection.
+        :param bool passive: Use only an already open connection, without
+                             postponing its closing as idle.
+        """
+        fs = self._acquire(space, passive)
+        try:
+            yield fs
+        finally:
+            self.release(space, passive)
+
+    def _acquire(self, space, passive=False):
+        """
+        Get a connection to a space, opening it if necessary.
+
+        Each call must be paired with a call to `release`.
+
+        :param str space: The space name or `None` for the root connection.
+        :param bool passive: Use only an already open connection, without
+                             postponing its closing as idle.
+        :return: The OnedataFS connection.
+        """
+        fs = self._take(space, passive)
+        if fs is not None:
+            return fs
+        if passive:
+            raise errors.ResourceNotFound('/%s' % (space or ''))
+
+        with self._lock:
+            space_lock = self._space_locks.setdefault(space, threading.Lock())
+
+        with space_lock:
+            # Another thread may have opened the connection meanwhile
+            fs = self._take(space)
+            if fs is not None:
+                return fs
+
+            self.log.info("Mounting space %s", space or '/')
+            fs = self.connect(space)
+            with self._lock:
+                self._connections[space] = fs
+                self._users[space] = self._users.get(space, 0) + 1
+                self._last_used[space] = time.time()
+
+        return fs
+
+    def _take(self, space, passive=False):
+        """
+        Start using an open connection, so that it cannot be closed.
+
+        :param str space: The space name or `None` for the root connection.
+        :param bool passive: Whether to keep the last usage time.
+        :return: The OnedataFS connection or `None` if it is not open.
+        """
+        with self._lock:
+            fs = self._connections.get(space)
+            if fs is not None:
+                self._users[space] = self._users.get(space, 0) + 1
+                if not passive:
+                    self._last_used[space] = time.time()
+            return fs
+
+    def release(self, space, passive=False):
+        """
+        Mark the end of usage of a connection acquired by `_acquire`.
+
+        :param str space: The space name or `None` for the root connection.
+        :param bool passive: Whether to keep the last usage time.
+        """
+        with self._lock:
+            self._users[space] -= 1
+            if not passive:
+                self._last_used[space] = time.time()
+
+    def active(self):
+        """
+        List spaces with open connections.
+
+        :return list: Names of currently mounted spaces.
+        """
+        with self._lock:
+            return sorted(s for s in self._connections if s is not None)
+
+    def release_idle(self):
+        """Close connections which have not been used for `idle_timeout`."""
+        now = time.time()
+        with self._lock:
+            idle = [space for space in self._connections
+                    if not self._users.get(space) and
+                    now - self._last_used[space] >= self.idle_timeout]
+            closed = [(space, self._connections.pop(space))
+                      for space in idle]
+
+        for space, fs in closed:
+            self.log.info("Unmounting idle space %s", space or '/')
+            try:
+                fs.close()
+            except Exception as e:
+                self.log.warning("Cannot close connection to space %s: %s",
+                                 space, e)
+
+    def start(self):
+        """Start closing idle connections in a background thread."""
+        if self._reaper is not None or not self.idle_timeout:
+            return
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._run,
+                                        name='onedatafs-space-pool')
+        self._reaper.daemon = True
+        self._reaper.start()
+
+    def close(self):
+        """Stop the background thread and close all connections."""
+        self._stop.set()
+        if self._reaper is not None:
+            self._reaper.join()
+            self._reaper = None
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for fs in connections:
+            fs.close()
+
+    def _run(self):
+        """Periodically close idle connections until stopped."""
+        interval = max(1.0, self.idle_timeout / 2.0)
+        while not self._stop.wait(interval):
+            self.release_idle()
+
+
+class _SpaceFile(object):
+    """File opened in a space, keeping its connection in use until closed."""
+
+    def __init__(self, f, release):
+        self._f = f
+        self._release = release
+
+    def close(self):
+        try:
+            self._f.close()
+        finally:
+            if self._release is not None:
+                self._release()
+                self._release = None
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MultiSpaceFS(FS):
+    """
+    Filesystem exposing all spaces accessible with a token as directories.
+
+    The root directory lists the spaces and cannot be modified, while all
+    operations below a space directory are delegated to a connection to
+    that space taken from a `SpacePool`. A space is mounted only if it is
+    present in the root listing.
+    """
+
+    def __init__(self, pool, passive=False, spaces_ttl=60.0):
+        """
+        Create the filesystem.
+
+        :param SpacePool pool: Pool of connections to individual spaces.
+        :param bool passive: Access only already mounted spaces, without
+                             postponing their unmounting, for background
+                             tasks such as indexing.
+        :param float spaces_ttl: Seconds for which the list of spaces is
+                                 cached to validate space names.
+        """
+        super(MultiSpaceFS, self).__init__()
+        self.pool = pool
+        self.passive = passive
+        self.spaces_ttl = spaces_ttl
+        self._mounted_at = time.time()
+        self._spaces = frozenset()
+        self._spaces_listed_at = None
+        self._meta = {
+            'case_insensitive': False,
+            'network': True,
+            'read_only': False,
+            'thread_safe': True,
+            'unicode_paths': True,
+        }
+
+    def __repr__(self):
+        """Return the representation of the filesystem."""
+        return 'MultiSpaceFS()'
+
+    def passive_view(self):
+        """
+        Get a view of the mounted spaces which does not keep them mounted.
+
+        :return MultiSpaceFS: The view sharing this connection pool.
+        """
+        return MultiSpaceFS(self.pool, passive=True,
+                            spaces_ttl=self.spaces_ttl)
+
+    def mounted_spaces(self):
+        """
+        List the currently mounted spaces.
+
+        :return list: Names of the mounted spaces.
+        """
+        return self.pool.active()
+
+    def _split(self, path):
+        """
+        Split a path into the space name and the absolute path.
+
+        :param str path: Path within this filesystem.
+        :return tuple: The space name or `None` for the root, and the
+                       normalized absolute path.
+        """
+        path = abspath(normpath(path))
+        parts = iteratepath(path)
+        return (parts[0] if parts else None), path
+
+    def _check_space(self, space):
+        """
+        Check that a space exists before a connection to it is opened.
+
+        The list of spaces is cached for `spaces_ttl` seconds and listed
+        again when an unknown name is requested after that time.
+
+        :param str space: The space name.
+        """
+        if space in self._spaces or space in self.pool.active():
+            return
+
+        listed_at = self._spaces_listed_at
+        if listed_at is None or time.time() - listed_at >= self.spaces_ttl:
+            with self.pool.use(None) as fs:
+                self._spaces = frozenset(fs.listdir('/'))
+            self._spaces_listed_at = time.time()
+            if space in self._spaces:
+                return
+
+        raise errors.ResourceNotFound('/' + space)
+
+    def _use(self, space):
+        """
+        Get a connection to a space, mounting it if necessary.
+
+        :param str space: The space name or `None` for the root connection.
+        :return: Context manager yielding the connection.
+        """
+        if space is not None and not self.passive:
+            self._check_space(space)
+        return self.pool.use(space, passive=self.passive)
+
+    def _check_writable(self, path):
+        """
+        Reject modifications of the root or the list of spaces.
+
+        :param str path: Path within this filesystem.
+        :return str: The space name.
+        """
+        space, path = self._split(path)
+        if space is None or path == '/' + space:
+            raise errors.ResourceReadOnly(path)
+        return space
+
+    def getinfo(self, path, namespaces=None):
+        """
+        Get details of a resource, space directories are stated unmounted.
+
+        :param str path: The resource path.
+        :param list namespaces: Info namespaces to fetch.
+        :return Info: The resource details.
+        """
+        space, path = self._split(path)
+        if space is None:
+            return Info({
+                'basic': {'name': '', 'is_dir': True},
+                'details': {'type': 1, 'size': 0,
+                            'accessed': self._mounted_at,
+                            'created': self._mounted_at,
+                            'modified': self._mounted_at},
+            })
+        if path == '/' + space and space not in self.pool.active():
+            # Stat the space directory without mounting the space
+            space = None
+        with self._use(space) as fs:
+            return fs.getinfo(path, namespaces=namespaces)
+
+    def listdir(self, path):
+        """
+        List names of directory entries.
+
+        :param str path: The directory path.
+        :return list: The entry names.
+        """
+        space, path = self._split(path)
+        with self._use(space) as fs:
+            return fs.listdir(path)
+
+    def scandir(self, path, namespaces=None, page=None):
+        """
+        List details of directory entries.
+
+        :param str path: The directory path.
+        :param list namespaces: Info namespaces to fetch.
+        :param tuple page: Range of entries to list.
+        :return: Iterator of entry details.
+        """
+        space, path = self._split(path)
+        with self._use(space) as fs:
+            return iter(list(fs.scandir(path, namespaces=namespaces,
+                                        page=page)))
+
+    def makedir(self, path, permissions=None, recreate=False):
+        """
+        Create a directory within a space.
+
+        :param str path: The directory path.
+        :param permissions: Permissions of the new directory.
+        :param bool recreate: Whether an existing directory is accepted.
+        :return SubFS: The created directory.
+        """
+        space = self._check_writable(path)
+        with self._use(space) as fs:
+            fs.makedir(self._split(path)[1], permissions=permissions,
+                       recreate=recreate)
+        return self.opendir(path)
+
+    def openbin(self, path, mode='r', buffering=-1, **options):
+        """
+        Open a file within a space in binary mode.
+
+        The space connection stays in use until the file is closed.
+
+        :param str path: The file path.
+        :param str mode: The open mode.
+        :param int buffering: Buffering policy.
+        :return: The binary file object.
+        """
+        space = self._check_writable(path)
+        if not self.passive:
+            self._check_space(space)
+        fs = self.pool._acquire(space, self.passive)
+        release = functools.partial(self.pool.release, space, self.passive)
+        try:
+            f = fs.openbin(self._split(path)[1], mode=mode,
+                           buffering=buffering, **options)
+        except Exception:
+            release()
+            raise
+        return _SpaceFile(f, release)
+
+    def remove(self, path):
+        """
+        Remove a file within a space.
+
+        :param str path: The file path.
+        """
+        space = self._check_writable(path)
+        with self._use(space) as fs:
+            fs.remove(self._split(path)[1])
+
+    def removedir(self, path):
+        """
+        Remove an empty directory within a space.
+
+        :param str path: The directory path.
+        """
+        space = self._check_writable(path)
+        with self._use(space) as fs:
+            fs.removedir(self._split(path)[1])
+
+    def removetree(self, dir_path):
+        """
+        Remove a directory within a space with all its contents.
+
+        :param str dir_path: The directory path.
+        """
+        space = self._check_writable(dir_path)
+        with self._use(space) as fs:
+            fs.removetree(self._split(dir_path)[1])
+
+    def setinfo(self, path, info):
+        """
+        Set details of a resource within a space.
+
+        :param str path: The resource path.
+        :param dict info: The details to set.
+        """
+        space = self._check_writable(path)
+        with self._use(space) as fs:
+            fs.setinfo(self._split(path)[1], info)
+
+    def move(self, src_path, dst_path, overwrite=False, **kwargs):
+        """
+        Move a file or directory, copying it if the spaces differ.
+
+        :param str src_path: The source path.
+        :param str dst_path: The destination path.
+        :param bool overwrite: Whether to overwrite an existing file.
+        """
+        src_space = self._check_writable(src_path)
+        dst_space = self._check_writable(dst_path)
+        if src_space != dst_space:
+            if not self.getinfo(src_path).is_dir:
+                return super(MultiSpaceFS, self).move(
+                    src_path, dst_path, overwrite=overwrite, **kwargs)
+            if self.exists(dst_path):
+                raise errors.DestinationExists(dst_path)
+            return move_dir(self, src_path, self, dst_path)
+        with self._use(src_space) as fs:
+            fs.move(self._split(src_path)[1], self._split(dst_path)[1],
+                    overwrite=overwrite, **kwargs)
+
+    def close(self):
+        """Close the filesystem and, unless passive, all connections."""
+        if not self.isclosed() and not self.passive:
+            self.pool.close()
+        super(MultiSpaceFS, self).close()
@@ -0,0 +1,52 @@
+# coding: utf-8
+"""Statistics of data transfers between Jupyter and OnedataFS."""
+
+import threading
+
+
+class TransferStats(object):
+    """
+    Counters of transferred bytes and time per transfer route.
+
+    The snapshot allows comparing throughput of the proxy and direct IO
+    routes in order to tune the size threshold used to select them.
+    """
+
+    def __init__(self):
+        """Create empty statistics."""
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    def record(self, route, direction, size, duration):
+        """
+        Record a single completed transfer.
+
+        :param str route: The route used for the transfer, e.g. `direct`.
+        :param str direction: `read` or `write`.
+        :param int size: Number of transferred bytes.
+        :param float duration: Duration of the transfer in seconds.
+        """
+        with self._lock:
+            counters = self._counters.setdefault(
+                (route, direction), {'count': 0, 'bytes': 0, 'seconds': 0.0})
+            counters['count'] += 1
+            counters['bytes'] += size
+            counters['seconds'] += duration
+
+    def snapshot(self):
+        """
+        Return the current statistics.
+
+        :return dict: Mapping of route to directions, each with transfer
+                      `count`, total `bytes`, total `seconds` and average
+                      `throughput` in bytes per second.
+        """
+        result = {}
+        with self._lock:
+            for (route, direction), counters in self._counters.items():
+                stats = dict(counters)
+                stats['throughput'] = \
+                    stats['bytes'] / stats['seconds'] \
+                    if stats['seconds'] > 0 else None
+                result.setdefault(route, {})[direction] = stats
+        return result
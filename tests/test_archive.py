@@ -0,0 +1,124 @@
+# coding: utf-8
+"""Tests of the streaming export and import of directory archives."""
+
+import io
+import tarfile
+import zipfile
+
+from fs.memoryfs import MemoryFS
+
+from onedatafs_jupyter import archive as archive_module
+from onedatafs_jupyter.archive import ArchiveError, ChunkWriter, \
+    _target_path, detect_format, extract_archive, write_archive
+
+import pytest
+
+
+def make_tree():
+    fs = MemoryFS()
+    fs.makedirs('/data/sub/empty')
+    fs.makedirs('/data/.hidden')
+    fs.writetext('/data/a.txt', u'hello')
+    fs.writebytes('/data/sub/big.bin', bytes(bytearray(range(256))) * 4096)
+    fs.writetext('/data/.secret', u'skipped')
+    fs.writetext('/data/.hidden/b.txt', u'skipped')
+    fs.setinfo('/data/sub', {'details': {'modified': 1000000000.0}})
+    return fs
+
+
+@pytest.mark.parametrize('name', [
+    '../escape.txt', 'a/../../escape.txt', '..\\escape.txt', '..', '',
+])
+def test_traversal_entry_names_are_rejected(name):
+    with pytest.raises(ArchiveError):
+        _target_path('/target', name)
+
+
+@pytest.mark.parametrize('name, target', [
+    ('a.txt', '/target/a.txt'),
+    ('dir/./b.txt', '/target/dir/b.txt'),
+    ('dir/../c.txt', '/target/c.txt'),
+    ('/etc/passwd', '/target/etc/passwd'),
+    ('dir\\d.txt', '/target/dir/d.txt'),
+])
+def test_entries_are_extracted_below_target(name, target):
+    assert _target_path('/target', name) == target
+
+
+@pytest.mark.parametrize('fmt', ['zip', 'tar.gz'])
+def test_archive_round_trip(fmt):
+    src = make_tree()
+    archive = io.BytesIO()
+    write_archive(src, '/data', archive, fmt, chunk_size=1000)
+
+    archive.seek(0)
+    assert detect_format(archive) == fmt
+
+    dst = MemoryFS()
+    extracted = extract_archive(dst, '/imported', archive, fmt, workers=2)
+
+    assert sorted(extracted) == ['/imported/a.txt', '/imported/sub/big.bin']
+    assert dst.readtext('/imported/a.txt') == u'hello'
+    assert dst.readbytes('/imported/sub/big.bin') == \
+        src.readbytes('/data/sub/big.bin')
+    assert dst.isdir('/imported/sub/empty')
+    assert not dst.exists('/imported/.secret')
+    assert not dst.exists('/imported/.hidden')
+
+
+def test_zip_entries_are_written_from_local_files_before_python_36(
+        monkeypatch):
+    monkeypatch.setattr(archive_module.sys, 'version_info', (3, 5, 2))
+    src = make_tree()
+    archive = io.BytesIO()
+    write_archive(src, '/data', archive, 'zip')
+
+    archive.seek(0)
+    with zipfile.ZipFile(archive) as zf:
+        assert zf.read('sub/big.bin') == src.readbytes('/data/sub/big.bin')
+        assert zf.getinfo('a.txt').external_attr >> 16 & 0o777 == 0o644
+
+
+def test_tar_directories_keep_modification_time():
+    archive = io.BytesIO()
+    write_archive(make_tree(), '/data', archive, 'tar.gz')
+
+    archive.seek(0)
+    with tarfile.open(fileobj=archive, mode='r:gz') as tar:
+        assert tar.getmember('sub').mtime == 1000000000
+
+
+def test_invalid_archive_is_rejected():
+    with pytest.raises(ArchiveError):
+        extract_archive(MemoryFS(), '/imported',
+                        io.BytesIO(b'PK\x03\x04 not a zip'), 'zip')
+
+
+def test_archive_is_streamed_in_acknowledged_chunks():
+    chunks = []
+
+    def consume(chunk):
+        chunks.append(chunk)
+        if chunk is not None:
+            writer.consumed()
+
+    writer = ChunkWriter(consume, chunk_size=4096, max_chunks=1)
+    write_archive(make_tree(), '/data', writer, 'zip')
+    writer.close()
+
+    assert chunks[-1] is None
+    assert all(len(chunk) >= 4096 for chunk in chunks[:-2])
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks[:-1]))) as archive:
+        assert archive.read('a.txt') == b'hello'
+
+
+def test_cancelled_stream_fails_writes():
+    chunks = []
+    writer = ChunkWriter(chunks.append, chunk_size=1)
+    writer.cancelled.set()
+
+    with pytest.raises(IOError):
+        writer.write(b'data')
+    with pytest.raises(IOError):
+        writer.close()
+    assert chunks == [None]
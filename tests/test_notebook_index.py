@@ -0,0 +1,96 @@
+# coding: utf-8
+"""Tests of the full-text index of notebook cell sources."""
+
+import errno
+import logging
+import sqlite3
+
+from fs.memoryfs import MemoryFS
+
+import nbformat
+from nbformat.v4 import new_code_cell, new_notebook
+
+from onedatafs_jupyter import notebook_index
+from onedatafs_jupyter.notebook_index import NotebookIndex
+from onedatafs_jupyter.resilience import ResilientFS
+
+import pytest
+
+
+class FakeManager(object):
+    """Contents manager stub providing the indexed storage."""
+
+    def __init__(self, fs):
+        self.log = logging.getLogger(__name__)
+        self.storage = ResilientFS(fs, timeout=0)
+        self.background_storage = self.storage
+
+
+def write_notebook(fs, path, *sources):
+    nb = new_notebook(cells=[new_code_cell(s) for s in sources])
+    fs.writetext(path, nbformat.writes(nb))
+
+
+def supports(module):
+    try:
+        sqlite3.connect(':memory:').execute(
+            "CREATE VIRTUAL TABLE probe USING %s(x)" % module)
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+@pytest.fixture(params=['fts5', 'fts4', None])
+def index(request, tmpdir, monkeypatch):
+    module = request.param
+    if module is not None and not supports(module):
+        pytest.skip('SQLite does not support %s' % module)
+    monkeypatch.setattr(notebook_index, '_fts_module', lambda conn: module)
+    return NotebookIndex(FakeManager(MemoryFS()),
+                         str(tmpdir.join('index.sqlite')), throttle=0)
+
+
+def test_only_cell_sources_are_matched(index):
+    fs = index.parent.storage.fs
+    fs.makedir('/numpy')
+    write_notebook(fs, '/numpy/analysis.ipynb', 'import pandas')
+    index.scan()
+
+    assert index.search('pandas') == [
+        {'path': 'numpy/analysis.ipynb', 'cells': [0]}]
+    assert index.search('numpy') == []
+    assert index.search('analysis') == []
+
+
+def test_storage_failure_keeps_notebook_searchable(index):
+    fs = index.parent.storage.fs
+    write_notebook(fs, '/a.ipynb', 'import pandas')
+    index.scan()
+    write_notebook(fs, '/a.ipynb', 'import pandas', 'import numpy')
+
+    readbytes = fs.readbytes
+
+    def fail(path):
+        raise IOError(errno.EIO, 'Input/output error')
+    fs.readbytes = fail
+    index.scan()
+    assert index.search('pandas') == [{'path': 'a.ipynb', 'cells': [0]}]
+
+    fs.readbytes = readbytes
+    index.scan()
+    assert index.search('numpy') == [{'path': 'a.ipynb', 'cells': [1]}]
+
+
+def test_broken_notebook_is_not_parsed_again(index, monkeypatch):
+    fs = index.parent.storage.fs
+    fs.writetext('/broken.ipynb', '{not json')
+    index.scan()
+
+    parsed = []
+    reads = nbformat.reads
+    monkeypatch.setattr(nbformat, 'reads', lambda *args, **kwargs:
+                        parsed.append(args) or reads(*args, **kwargs))
+    index.scan()
+
+    assert parsed == []
+    assert index.search('json') == []
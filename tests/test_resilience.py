@@ -0,0 +1,191 @@
+# coding: utf-8
+"""Tests of timeouts, retries and circuit breaking of storage operations."""
+
+import asyncio
+import errno
+import threading
+import time
+
+from fs import errors
+from fs.memoryfs import MemoryFS
+
+from onedatafs_jupyter.resilience import CircuitBreaker, CircuitOpenError, \
+    ResilientFS, StorageTimeoutError, StorageUnavailableError
+
+import pytest
+
+
+class FlakyFS(MemoryFS):
+    """MemoryFS failing or stalling a configured number of operations."""
+
+    def __init__(self):
+        super(FlakyFS, self).__init__()
+        self.failures = 0
+        self.error = IOError(errno.EIO, 'Input/output error')
+        self.delay = 0.0
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def _operation(self):
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        if self.delay:
+            time.sleep(self.delay)
+        self.release.wait()
+
+    def getinfo(self, path, namespaces=None):
+        self._operation()
+        return super(FlakyFS, self).getinfo(path, namespaces=namespaces)
+
+    def writebytes(self, path, contents):
+        self._operation()
+        return super(FlakyFS, self).writebytes(path, contents)
+
+
+def resilient(fs, **options):
+    options.setdefault('timeout', 1.0)
+    options.setdefault('backoff', 0.0)
+    options.setdefault('backoff_max', 0.0)
+    return ResilientFS(fs, **options)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60.0)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_lets_single_trial_through_after_reset_timeout():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_transient_failures_are_retried():
+    fs = FlakyFS()
+    fs.failures = 2
+    storage = resilient(fs, retries=2)
+
+    assert storage.getinfo('/').is_dir
+    assert fs.calls == 3
+    assert storage.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_modifications_and_missing_resources_are_not_retried():
+    fs = FlakyFS()
+    fs.failures = 1
+    storage = resilient(fs, retries=2)
+
+    with pytest.raises(IOError):
+        storage.writebytes('/a', b'data')
+    assert fs.calls == 1
+
+    with pytest.raises(errors.ResourceNotFound):
+        storage.getinfo('/missing')
+    assert fs.calls == 2
+
+
+def test_operations_are_not_retried_on_the_event_loop():
+    fs = FlakyFS()
+    fs.failures = 1
+    storage = resilient(fs, retries=2)
+
+    async def get_info():
+        return storage.getinfo('/')
+
+    with pytest.raises(IOError):
+        asyncio.new_event_loop().run_until_complete(get_info())
+    assert fs.calls == 1
+
+
+def test_timed_out_operations_are_not_retried():
+    fs = FlakyFS()
+    fs.delay = 0.3
+    storage = resilient(fs, timeout=0.1, retries=2)
+
+    with pytest.raises(StorageTimeoutError):
+        storage.getinfo('/')
+    assert fs.calls == 1
+
+
+def test_open_circuit_fails_fast():
+    fs = FlakyFS()
+    fs.failures = 2
+    storage = resilient(fs, retries=0,
+                        breaker=CircuitBreaker(failure_threshold=2))
+
+    for _ in range(2):
+        with pytest.raises(IOError):
+            storage.getinfo('/')
+    with pytest.raises(CircuitOpenError):
+        storage.getinfo('/')
+    assert fs.calls == 2
+
+
+def test_operations_fail_when_all_workers_are_busy():
+    fs = FlakyFS()
+    fs.release.clear()
+    storage = resilient(fs, timeout=0.1, max_workers=1, retries=0)
+
+    with pytest.raises(StorageTimeoutError):
+        storage.getinfo('/')
+    with pytest.raises(StorageUnavailableError):
+        storage.getinfo('/')
+    assert fs.calls == 1
+    fs.release.set()
+
+
+def test_path_is_busy_until_abandoned_modification_completes():
+    fs = FlakyFS()
+    fs.release.clear()
+    storage = resilient(fs, timeout=0.1)
+
+    with pytest.raises(StorageTimeoutError):
+        storage.writebytes('/a', b'first')
+    with pytest.raises(StorageUnavailableError):
+        storage.writebytes('/a', b'second')
+    assert fs.calls == 1
+
+    fs.release.set()
+    deadline = time.time() + 1.0
+    while time.time() < deadline:
+        try:
+            storage.writebytes('/a', b'third')
+            break
+        except StorageUnavailableError:
+            time.sleep(0.01)
+    assert fs.readbytes('/a') == b'third'
+
+
+def test_transfer_timeout_depends_on_known_size():
+    fs = FlakyFS()
+    fs.delay = 0.3
+    storage = resilient(fs, timeout=0.1, min_throughput=1000)
+
+    assert storage.transfer('getinfo', '/', 1000, fs.getinfo, '/').is_dir
+    with pytest.raises(StorageTimeoutError):
+        storage.transfer('getinfo', '/', None, fs.getinfo, '/')
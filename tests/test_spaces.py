@@ -0,0 +1,123 @@
+# coding: utf-8
+"""Tests of the per-space connection pool and the multi space filesystem."""
+
+import threading
+import time
+
+from fs import errors
+from fs.memoryfs import MemoryFS
+
+from onedatafs_jupyter.spaces import MultiSpaceFS, SpacePool
+
+import pytest
+
+
+class FakeConnection(object):
+    """Connection stub recording whether it has been closed."""
+
+    def __init__(self, space):
+        self.space = space
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_connections_are_opened_once_per_space():
+    opened = []
+    pool = SpacePool(lambda space: opened.append(space) or
+                     FakeConnection(space))
+
+    with pool.use('a') as first:
+        with pool.use('a') as second:
+            assert first is second
+    with pool.use('b'):
+        pass
+
+    assert opened == ['a', 'b']
+    assert pool.active() == ['a', 'b']
+
+
+def test_release_idle_closes_only_unused_connections():
+    pool = SpacePool(FakeConnection, idle_timeout=0.0)
+
+    with pool.use('a') as used:
+        with pool.use('b') as unused:
+            pass
+        pool.release_idle()
+
+        assert not used.closed
+        assert unused.closed
+        assert pool.active() == ['a']
+
+
+def test_passive_use_does_not_mount_or_postpone_unmounting():
+    pool = SpacePool(FakeConnection, idle_timeout=60.0)
+
+    with pytest.raises(errors.ResourceNotFound):
+        with pool.use('a', passive=True):
+            pass
+    assert pool.active() == []
+
+    with pool.use('a'):
+        pass
+    pool._last_used['a'] = 0.0
+    with pool.use('a', passive=True):
+        pass
+    pool.release_idle()
+    assert pool.active() == []
+
+
+def test_acquired_connection_is_never_closed_by_release_idle():
+    pool = SpacePool(FakeConnection, idle_timeout=0.0)
+    stop = threading.Event()
+    failures = []
+
+    def reaper():
+        while not stop.is_set():
+            pool.release_idle()
+
+    def user():
+        while not stop.is_set():
+            with pool.use('a') as fs:
+                if fs.closed:
+                    failures.append(fs)
+
+    threads = [threading.Thread(target=reaper)] + \
+        [threading.Thread(target=user) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(1.0)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    assert failures == []
+
+
+def test_unknown_space_is_not_mounted():
+    root = MemoryFS()
+    root.makedirs('/space1/dir')
+    pool = SpacePool(lambda space: root, idle_timeout=0.0)
+    multi = MultiSpaceFS(pool)
+
+    assert multi.listdir('/space1') == ['dir']
+    with pytest.raises(errors.ResourceNotFound):
+        multi.getinfo('/nope/x.txt')
+    assert pool.active() == ['space1']
+
+
+def test_directory_is_moved_between_spaces():
+    root = MemoryFS()
+    root.makedirs('/space1/dir/sub')
+    root.writetext('/space1/dir/sub/a.txt', 'a')
+    root.makedirs('/space2')
+    multi = MultiSpaceFS(SpacePool(lambda space: root))
+
+    multi.move('/space1/dir', '/space2/moved')
+
+    assert not root.exists('/space1/dir')
+    assert root.readtext('/space2/moved/sub/a.txt') == 'a'
+    root.makedir('/space1/dir')
+    with pytest.raises(errors.DestinationExists):
+        multi.move('/space1/dir', '/space2/moved')